@@ -1,9 +1,13 @@
 import sqlite3
 import secrets
+import hashlib
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 from passlib.context import CryptContext
 import os
+from .ttl_cache import TTLCache
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,6 +15,35 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # Database path
 DB_PATH = os.getenv("API_KEYS_DB_PATH", "/app/data/api_keys.db")
 
+# Recently verified keys, keyed by key digest (avoids bcrypt on every request)
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "256"))
+API_KEY_CACHE_TTL = int(os.getenv("API_KEY_CACHE_TTL", "60"))
+_verified_keys = TTLCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL)
+
+# Keys created before key_digest existed can only be found by bcrypt-checking each of them.
+# Digests that failed recently skip that scan, and scans are capped per minute so a flood of
+# bogus keys can't cost N bcrypt checks each. Legacy keys are backfilled on first use; once
+# list_api_keys shows none with "legacy": true (rotate any that stay unused), set
+# API_KEY_LEGACY_LOOKUP=false to turn the scan off entirely.
+API_KEY_LEGACY_LOOKUP = os.getenv("API_KEY_LEGACY_LOOKUP", "true").lower() == "true"
+API_KEY_LEGACY_SCANS_PER_MINUTE = int(os.getenv("API_KEY_LEGACY_SCANS_PER_MINUTE", "30"))
+API_KEY_REJECTED_TTL = int(os.getenv("API_KEY_REJECTED_TTL", "300"))
+_rejected_keys = TTLCache(4096, API_KEY_REJECTED_TTL)
+_legacy_scans = {"window_start": 0.0, "count": 0}
+_legacy_scans_lock = threading.Lock()
+
+
+def _allow_legacy_scan() -> bool:
+    """Fixed one-minute window limit on legacy key scans"""
+    with _legacy_scans_lock:
+        now = time.monotonic()
+        if now - _legacy_scans["window_start"] >= 60:
+            _legacy_scans.update(window_start=now, count=0)
+        if _legacy_scans["count"] >= API_KEY_LEGACY_SCANS_PER_MINUTE:
+            return False
+        _legacy_scans["count"] += 1
+        return True
+
 
 def get_db():
     """Get database connection"""
@@ -38,6 +71,15 @@ def init_db():
         )
     """)
     
+    # Migration: add key_digest lookup column for databases created before it existed.
+    # Existing keys keep a NULL digest until their first successful use.
+    cursor.execute("PRAGMA table_info(api_keys)")
+    columns = [row['name'] for row in cursor.fetchall()]
+    if 'key_digest' not in columns:
+        cursor.execute("ALTER TABLE api_keys ADD COLUMN key_digest TEXT")
+    
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_api_keys_digest ON api_keys (key_digest)")
+    
     conn.commit()
     conn.close()
 
@@ -53,6 +95,14 @@ def hash_api_key(api_key: str) -> str:
     return pwd_context.hash(api_key)
 
 
+def digest_api_key(api_key: str) -> str:
+    """
+    Fast SHA-256 digest of an API key, used as an indexed lookup column
+    Keys are 256 bits of randomness, so an unsalted digest is safe to store
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
 def verify_api_key(plain_key: str, hashed_key: str) -> bool:
     """Verify an API key against its hash"""
     return pwd_context.verify(plain_key, hashed_key)
@@ -70,6 +120,7 @@ def create_api_key(name: str, description: Optional[str] = None,
     # Generate the key
     plain_key = generate_api_key()
     key_hash = hash_api_key(plain_key)
+    key_digest = digest_api_key(plain_key)
     
     # Calculate expiration
     created_at = datetime.now()
@@ -79,9 +130,9 @@ def create_api_key(name: str, description: Optional[str] = None,
     
     # Insert into database
     cursor.execute("""
-        INSERT INTO api_keys (key_hash, name, description, created_at, expires_at, is_active)
-        VALUES (?, ?, ?, ?, ?, 1)
-    """, (key_hash, name, description, created_at, expires_at))
+        INSERT INTO api_keys (key_hash, key_digest, name, description, created_at, expires_at, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+    """, (key_hash, key_digest, name, description, created_at, expires_at))
     
     key_id = cursor.lastrowid
     conn.commit()
@@ -98,57 +149,117 @@ def create_api_key(name: str, description: Optional[str] = None,
     }
 
 
+def _is_expired(expires_at) -> bool:
+    if not expires_at:
+        return False
+    return datetime.now() > datetime.fromisoformat(str(expires_at))
+
+
+def _find_legacy_key(cursor, api_key: str, key_digest: str):
+    """
+    Find a key created before key_digest existed (one bcrypt check per legacy key)
+    On match the digest is backfilled so later lookups use the index
+    """
+    if not API_KEY_LEGACY_LOOKUP or _rejected_keys.get(key_digest):
+        return None
+    cursor.execute("SELECT 1 FROM api_keys WHERE is_active = 1 AND key_digest IS NULL LIMIT 1")
+    if cursor.fetchone() is None:
+        return None
+    if not _allow_legacy_scan():
+        print("Legacy API key scan limit reached, rejecting key without checking legacy keys")
+        return None
+    
+    cursor.execute("""
+        SELECT id, key_hash, name, description, created_at, last_used_at, expires_at, is_active
+        FROM api_keys
+        WHERE is_active = 1 AND key_digest IS NULL
+    """)
+    
+    for key_row in cursor.fetchall():
+        if verify_api_key(api_key, key_row['key_hash']):
+            cursor.execute("UPDATE api_keys SET key_digest = ? WHERE id = ?", (key_digest, key_row['id']))
+            return key_row
+    
+    _rejected_keys.set(key_digest, True)
+    return None
+
+
 def validate_api_key(api_key: str) -> Optional[Dict]:
     """
     Validate an API key and return key info if valid
-    Updates last_used_at timestamp
+    Recently verified keys are served from an in-memory cache; last_used_at
+    is updated whenever the key is (re)verified against the database
     """
     if not api_key or not api_key.startswith("pp_"):
         return None
     
+    key_digest = digest_api_key(api_key)
+    
+    cached = _verified_keys.get(key_digest)
+    if cached:
+        if _is_expired(cached['expires_at']):
+            _verified_keys.pop(key_digest)
+            return None
+        return {k: v for k, v in cached.items() if k != 'expires_at'}
+    
     conn = get_db()
     cursor = conn.cursor()
     
-    # Get all active keys
+    # O(1) lookup of the candidate key by its digest
     cursor.execute("""
         SELECT id, key_hash, name, description, created_at, last_used_at, expires_at, is_active
         FROM api_keys
-        WHERE is_active = 1
-    """)
+        WHERE key_digest = ? AND is_active = 1
+    """, (key_digest,))
     
-    keys = cursor.fetchall()
+    key_row = cursor.fetchone()
+    if key_row and not verify_api_key(api_key, key_row['key_hash']):
+        key_row = None
     
-    for key_row in keys:
-        # Check if key matches
-        if verify_api_key(api_key, key_row['key_hash']):
-            # Check if expired
-            if key_row['expires_at']:
-                expires_at = datetime.fromisoformat(key_row['expires_at'])
-                if datetime.now() > expires_at:
-                    conn.close()
-                    return None
-            
-            # Update last_used_at
-            cursor.execute("""
-                UPDATE api_keys
-                SET last_used_at = ?
-                WHERE id = ?
-            """, (datetime.now(), key_row['id']))
-            conn.commit()
-            
-            result = {
-                "id": key_row['id'],
-                "name": key_row['name'],
-                "description": key_row['description'],
-                "created_at": key_row['created_at'],
-                "last_used_at": datetime.now().isoformat(),
-            }
-            
-            conn.close()
-            return result
+    if not key_row:
+        key_row = _find_legacy_key(cursor, api_key, key_digest)
+    
+    if not key_row:
+        conn.commit()
+        conn.close()
+        return None
+    
+    # Check if expired
+    if _is_expired(key_row['expires_at']):
+        conn.commit()
+        conn.close()
+        return None
     
+    # Update last_used_at
+    last_used_at = datetime.now()
+    cursor.execute("""
+        UPDATE api_keys
+        SET last_used_at = ?
+        WHERE id = ?
+    """, (last_used_at, key_row['id']))
+    conn.commit()
     conn.close()
-    return None
+    
+    result = {
+        "id": key_row['id'],
+        "name": key_row['name'],
+        "description": key_row['description'],
+        "created_at": key_row['created_at'],
+        "last_used_at": last_used_at.isoformat(),
+    }
+    
+    _verified_keys.set(key_digest, {**result, "expires_at": key_row['expires_at']})
+    return result
+
+
+def invalidate_cached_key(key_id: int) -> int:
+    """Drop a key from the verification cache (after revoke/delete)"""
+    return _verified_keys.pop_where(lambda entry: entry['id'] == key_id)
+
+
+def api_key_cache_stats() -> Dict:
+    """Verification cache size and hit/miss counters"""
+    return _verified_keys.stats()
 
 
 def list_api_keys() -> List[Dict]:
@@ -157,7 +268,7 @@ def list_api_keys() -> List[Dict]:
     cursor = conn.cursor()
     
     cursor.execute("""
-        SELECT id, name, description, created_at, last_used_at, expires_at, is_active
+        SELECT id, name, description, created_at, last_used_at, expires_at, is_active, key_digest
         FROM api_keys
         ORDER BY created_at DESC
     """)
@@ -171,7 +282,9 @@ def list_api_keys() -> List[Dict]:
             "created_at": row['created_at'],
             "last_used_at": row['last_used_at'],
             "expires_at": row['expires_at'],
-            "is_active": bool(row['is_active'])
+            "is_active": bool(row['is_active']),
+            # Not used since key digests were introduced; rotate if it stays unused
+            "legacy": row['key_digest'] is None
         })
     
     conn.close()
@@ -193,6 +306,7 @@ def revoke_api_key(key_id: int) -> bool:
     conn.commit()
     conn.close()
     
+    invalidate_cached_key(key_id)
     return rows_affected > 0
 
 
@@ -207,6 +321,7 @@ def delete_api_key(key_id: int) -> bool:
     conn.commit()
     conn.close()
     
+    invalidate_cached_key(key_id)
     return rows_affected > 0
 
 
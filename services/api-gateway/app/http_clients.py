@@ -0,0 +1,145 @@
+import os
+import time
+from typing import Dict, Optional
+import httpx
+
+# Connection pool configuration (shared by every upstream service)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+
+# One long-lived client (and therefore one connection pool) per upstream
+_upstreams: Dict[str, str] = {}
+_clients: Dict[str, httpx.AsyncClient] = {}
+_metrics: Dict[str, Dict] = {}
+
+
+def _http2_available() -> bool:
+    """Check if the optional h2 package needed for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _new_metrics() -> Dict:
+    return {
+        "requests": 0,
+        "errors": 0,
+        "in_flight": 0,
+        "total_latency_ms": 0.0,
+    }
+
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """HTTP transport that records per-upstream request metrics"""
+
+    def __init__(self, name: str, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = _metrics.setdefault(name, _new_metrics())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.metrics["requests"] += 1
+        self.metrics["in_flight"] += 1
+        started_at = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            self.metrics["in_flight"] -= 1
+            self.metrics["total_latency_ms"] += (time.perf_counter() - started_at) * 1000
+        if response.status_code >= 500:
+            self.metrics["errors"] += 1
+        return response
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    http2 = UPSTREAM_HTTP2
+    if http2 and not _http2_available():
+        print("Warning: UPSTREAM_HTTP2=true but the 'h2' package is not installed, using HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    transport = MeteredTransport(name, limits=limits, http2=http2)
+    return httpx.AsyncClient(transport=transport)
+
+
+def register_upstream(name: str, base_url: str):
+    """Register an upstream service that gets its own connection pool"""
+    _upstreams[name] = base_url
+
+
+def start_clients():
+    """Create a pooled client for every registered upstream (call on startup)"""
+    for name in _upstreams:
+        if name not in _clients:
+            _clients[name] = _create_client(name)
+
+
+async def close_clients():
+    """Close all pooled clients (call on shutdown)"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Get the pooled client for an upstream
+    Created lazily if startup hasn't run yet (e.g. in scripts)
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _clients[name] = client
+    return client
+
+
+def _pool_connections(client: httpx.AsyncClient) -> Optional[Dict]:
+    """Inspect the underlying httpcore pool, if the transport exposes one"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None
+
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "open": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+    }
+
+
+def pool_stats() -> Dict:
+    """Per-upstream pool configuration, connection counts and request metrics"""
+    stats = {}
+    for name, base_url in _upstreams.items():
+        metrics = _metrics.get(name, _new_metrics())
+        client = _clients.get(name)
+        completed = metrics["requests"] - metrics["in_flight"]
+        stats[name] = {
+            "base_url": base_url,
+            "started": client is not None and not client.is_closed,
+            "connections": _pool_connections(client) if client is not None else None,
+            "requests": metrics["requests"],
+            "in_flight": metrics["in_flight"],
+            "errors": metrics["errors"],
+            "avg_latency_ms": round(metrics["total_latency_ms"] / completed, 2) if completed else None,
+        }
+    return {
+        "limits": {
+            "max_connections": UPSTREAM_MAX_CONNECTIONS,
+            "max_keepalive_connections": UPSTREAM_MAX_KEEPALIVE,
+            "keepalive_expiry": UPSTREAM_KEEPALIVE_EXPIRY,
+            "http2": UPSTREAM_HTTP2,
+        },
+        "upstreams": stats,
+    }
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import re
+from typing import Iterable, List
+import httpx
+from . import http_clients
+from .ttl_cache import TTLCache
+
+# Serve product images through /api/images instead of hot-linking third-party hosts
+IMAGE_PROXY_ENABLED = os.getenv("IMAGE_PROXY_ENABLED", "true").lower() == "true"
+# Thumbnail width used in rewritten image_url values
+IMAGE_PROXY_WIDTH = int(os.getenv("IMAGE_PROXY_WIDTH", "256"))
+# Public base URL for rewritten links when the request's own host isn't reachable by clients
+IMAGE_PROXY_BASE_URL = os.getenv("IMAGE_PROXY_BASE_URL", "")
+
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Image ids the lookup service already knows, so each URL is registered once
+_registered = TTLCache(max_size=50000, ttl_seconds=24 * 3600)
+
+
+def image_id(url: str) -> str:
+    """Same id the lookup service derives for a remote image URL"""
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def valid_image_id(value: str) -> bool:
+    return bool(IMAGE_ID_PATTERN.match(value))
+
+
+def _remote_url(value) -> bool:
+    return isinstance(value, str) and value.startswith(("http://", "https://")) and "/api/images/" not in value
+
+
+async def rewrite_image_urls(records: Iterable[dict], base_url: str, lookup_url: str) -> List[dict]:
+    """
+    Point image_url at the local thumbnail proxy, keeping the original in image_source_url
+    URLs are registered with the lookup service first; if that fails they are left as-is
+    """
+    records = [r for r in records if isinstance(r, dict)]
+    if not IMAGE_PROXY_ENABLED:
+        return records
+
+    urls = {r["image_url"] for r in records if _remote_url(r.get("image_url"))}
+    unregistered = [url for url in urls if _registered.get(image_id(url)) is None]
+    if unregistered:
+        try:
+            client = http_clients.get_client("lookup")
+            response = await client.post(f"{lookup_url}/images/register", json={"urls": unregistered}, timeout=5.0)
+            response.raise_for_status()
+            for registered_id in response.json()["images"].values():
+                _registered.set(registered_id, True)
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            print(f"Image registration failed, serving original URLs: {e}")
+
+    base = (IMAGE_PROXY_BASE_URL or base_url).rstrip("/")
+    for record in records:
+        url = record.get("image_url")
+        if _remote_url(url) and _registered.get(image_id(url)):
+            record["image_source_url"] = url
+            record["image_url"] = f"{base}/api/images/{image_id(url)}?w={IMAGE_PROXY_WIDTH}"
+    return records
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, HTTPException, Depends, Response, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from typing import Optional
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
+from typing import Optional, List
+import asyncio
 import httpx
 import os
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from .network_utils import get_client_ip, is_trusted_network
+from . import http_clients, image_proxy
 
 
 # Import auth modules
@@ -27,17 +30,40 @@ else:
     # Split comma-separated origins
     cors_origins = [origin.strip() for origin in cors_origins_env.split(",")]
 
+# Headers the inventory service uses for paginated item lists
+PAGINATION_HEADERS = ["X-Total-Count", "X-Next-Cursor"]
+# Conditional GET: validators sent by the inventory service, and the request headers checked against them
+VALIDATOR_HEADERS = ["ETag", "Last-Modified", "Cache-Control"]
+CONDITIONAL_HEADERS = ["if-none-match", "if-modified-since"]
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=PAGINATION_HEADERS + VALIDATOR_HEADERS,
 )
 
 INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://inventory-service:8001")
 LOOKUP_SERVICE_URL = os.getenv("LOOKUP_SERVICE_URL", "http://lookup-service:8002")
 
+# Pooled, keep-alive HTTP clients for the upstream services
+http_clients.register_upstream("inventory", INVENTORY_SERVICE_URL)
+http_clients.register_upstream("lookup", LOOKUP_SERVICE_URL)
+# Change feed streams stay open indefinitely, so they get a pool of their own
+http_clients.register_upstream("events", INVENTORY_SERVICE_URL)
+
+@app.on_event("startup")
+async def startup_event():
+    http_clients.start_clients()
+    user_db.start_activity_flusher()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await http_clients.close_clients()
+    user_db.stop_activity_flusher()
+
 # ============================================================================
 # REQUEST MODELS
 # ============================================================================
@@ -47,6 +73,11 @@ class AddItemRequest(BaseModel):
     location: str = "Basement Pantry"
     quantity: int = 1
     expiry_date: Optional[str] = None
+    # Add to an existing item with the same barcode, location and expiry date instead of a new row
+    merge: bool = False
+
+class QuantityChangeRequest(BaseModel):
+    delta: int
 
 class ManualAddRequest(BaseModel):
     name: str
@@ -67,6 +98,31 @@ class UpdateItemRequest(BaseModel):
     expiry_date: Optional[str] = None
     notes: Optional[str] = None
 
+class BatchLookupRequest(BaseModel):
+    barcodes: List[str]
+
+class BulkItem(BaseModel):
+    # With only a barcode, the product details come from the lookup service
+    barcode: Optional[str] = None
+    name: Optional[str] = None
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    location: str = "Basement Pantry"
+    quantity: int = 1
+    expiry_date: Optional[str] = None
+    notes: Optional[str] = None
+
+class BulkItemOperation(BaseModel):
+    op: str  # create, update, delete or adjust
+    id: Optional[int] = None
+    item: Optional[BulkItem] = None
+    changes: Optional[UpdateItemRequest] = None
+    delta: Optional[int] = None
+
+class BulkItemsRequest(BaseModel):
+    operations: List[BulkItemOperation]
+    atomic: bool = False
+
 class CreateApiKeyRequest(BaseModel):
     name: str
     description: Optional[str] = None
@@ -109,9 +165,8 @@ async def root():
 @app.get("/health")
 async def health_check():
     try:
-        async with httpx.AsyncClient() as client:
-            inventory_health = await client.get(f"{INVENTORY_SERVICE_URL}/health", timeout=2.0)
-            lookup_health = await client.get(f"{LOOKUP_SERVICE_URL}/health", timeout=2.0)
+        inventory_health = await http_clients.get_client("inventory").get(f"{INVENTORY_SERVICE_URL}/health", timeout=2.0)
+        lookup_health = await http_clients.get_client("lookup").get(f"{LOOKUP_SERVICE_URL}/health", timeout=2.0)
         return {
             "status": "healthy",
             "auth_mode": AUTH_MODE,
@@ -439,6 +494,63 @@ async def delete_user(user_id: int, auth = Depends(require_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete user: {str(e)}")
 
+def conditional_headers(request: Request) -> dict:
+    return {h: request.headers[h] for h in CONDITIONAL_HEADERS if h in request.headers}
+
+def validator_headers(response: httpx.Response) -> dict:
+    return {h: response.headers[h] for h in VALIDATOR_HEADERS if h in response.headers}
+
+async def proxy_inventory_get(path: str, request: Request) -> Response:
+    """GET from the inventory service, passing the body and validators through untouched"""
+    try:
+        client = http_clients.get_client("inventory")
+        response = await client.get(f"{INVENTORY_SERVICE_URL}{path}", headers=conditional_headers(request), timeout=5.0)
+        if response.status_code == 304:
+            return Response(status_code=304, headers=validator_headers(response))
+        response.raise_for_status()
+        return Response(content=response.content, media_type="application/json", headers=validator_headers(response))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
+
+# ============================================================================
+# PRODUCT IMAGES (public: <img> tags can't send auth headers, and only
+# images registered by the gateway itself can be fetched)
+# ============================================================================
+
+IMAGE_HEADERS = ["Content-Type", "ETag", "Cache-Control", "Vary"]
+
+@app.get("/api/images/{image_id}")
+async def get_product_image(image_id: str, request: Request, w: Optional[int] = None, format: Optional[str] = None):
+    """Cached product thumbnail from the lookup service, honouring If-None-Match"""
+    if not image_proxy.valid_image_id(image_id):
+        raise HTTPException(status_code=404, detail="Image not registered")
+    params = {}
+    if w:
+        params["w"] = w
+    if format:
+        params["format"] = format
+    forward = {h: request.headers[h] for h in ("accept", "if-none-match") if h in request.headers}
+    client = http_clients.get_client("lookup")
+    try:
+        upstream = await client.send(
+            client.build_request("GET", f"{LOOKUP_SERVICE_URL}/images/{image_id}", params=params,
+                                 headers=forward, timeout=30.0),
+            stream=True
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Lookup service error: {str(e)}")
+
+    headers = {h: upstream.headers[h] for h in IMAGE_HEADERS if h in upstream.headers}
+    if upstream.status_code == 304:
+        await upstream.aclose()
+        return Response(status_code=304, headers=headers)
+    if upstream.status_code != 200:
+        await upstream.aread()
+        await upstream.aclose()
+        detail = upstream.json().get("detail") if upstream.headers.get("content-type") == "application/json" else None
+        raise HTTPException(status_code=upstream.status_code, detail=detail or "Image unavailable")
+    return StreamingResponse(upstream.aiter_bytes(), headers=headers, background=BackgroundTask(upstream.aclose))
+
 # ============================================================================
 # PROTECTED ENDPOINTS (Require authentication based on AUTH_MODE)
 # ============================================================================
@@ -446,96 +558,241 @@ async def delete_user(user_id: int, auth = Depends(require_admin)):
 @app.get("/api/lookup/{barcode}")
 async def lookup_barcode(barcode: str, request: Request, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{LOOKUP_SERVICE_URL}/lookup/{barcode}", timeout=10.0)
-            response.raise_for_status()
-            return response.json()
+        client = http_clients.get_client("lookup")
+        response = await client.get(f"{LOOKUP_SERVICE_URL}/lookup/{barcode}", timeout=10.0)
+        response.raise_for_status()
+        product = response.json()
+        await image_proxy.rewrite_image_urls([product], str(request.base_url), LOOKUP_SERVICE_URL)
+        return product
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Lookup service error: {str(e)}")
+
+@app.post("/api/lookup/batch")
+async def lookup_batch(request: BatchLookupRequest, http_request: Request, auth = Depends(get_current_auth)):
+    """Look up several barcodes in one call (e.g. after scanning a grocery haul)"""
+    try:
+        client = http_clients.get_client("lookup")
+        response = await client.post(f"{LOOKUP_SERVICE_URL}/lookup/batch", json=request.dict(), timeout=30.0)
+        if response.status_code == 400:
+            raise HTTPException(status_code=400, detail=response.json().get("detail"))
+        response.raise_for_status()
+        result = response.json()
+        await image_proxy.rewrite_image_urls(result.get("results", []), str(http_request.base_url), LOOKUP_SERVICE_URL)
+        return result
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Lookup service error: {str(e)}")
 
 @app.post("/api/items")
-async def add_item(request: AddItemRequest, auth = Depends(get_current_auth)):
+async def add_item(request: AddItemRequest, http_request: Request, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            lookup_response = await client.get(f"{LOOKUP_SERVICE_URL}/lookup/{request.barcode}", timeout=10.0)
+        lookup_client = http_clients.get_client("lookup")
+        inventory_client = http_clients.get_client("inventory")
+        lookup_response = await lookup_client.get(f"{LOOKUP_SERVICE_URL}/lookup/{request.barcode}", timeout=10.0)
             
-            if lookup_response.status_code == 200:
-                product_info = lookup_response.json()
-            else:
-                product_info = {
-                    "barcode": request.barcode,
-                    "name": f"Unknown Product ({request.barcode})",
-                    "brand": None,
-                    "image_url": None,
-                    "category": "Uncategorized",
-                    "found": False
-                }
-            
-            inventory_data = {
+        if lookup_response.status_code == 200:
+            product_info = lookup_response.json()
+        else:
+            product_info = {
                 "barcode": request.barcode,
-                "name": product_info.get("name", request.barcode),
-                "brand": product_info.get("brand"),
-                "image_url": product_info.get("image_url"),
-                "category": product_info.get("category", "Uncategorized"),
-                "location": request.location,
-                "quantity": request.quantity,
-                "expiry_date": request.expiry_date,
-                "manually_added": False
+                "name": f"Unknown Product ({request.barcode})",
+                "brand": None,
+                "image_url": None,
+                "category": "Uncategorized",
+                "found": False
             }
             
-            inventory_response = await client.post(f"{INVENTORY_SERVICE_URL}/items", json=inventory_data, timeout=5.0)
-            inventory_response.raise_for_status()
+        inventory_data = {
+            "barcode": request.barcode,
+            "name": product_info.get("name", request.barcode),
+            "brand": product_info.get("brand"),
+            "image_url": product_info.get("image_url"),
+            "category": product_info.get("category", "Uncategorized"),
+            "location": request.location,
+            "quantity": request.quantity,
+            "expiry_date": request.expiry_date,
+            "manually_added": False
+        }
+            
+        inventory_response = await inventory_client.post(f"{INVENTORY_SERVICE_URL}/items", json=inventory_data,
+                                                         params={"merge": "true"} if request.merge else None, timeout=5.0)
+        inventory_response.raise_for_status()
             
-            result = inventory_response.json()
-            result["product_info"] = product_info
-            return result
+        result = inventory_response.json()
+        result["product_info"] = product_info
+        result["merged"] = inventory_response.headers.get("X-Merged") == "true"
+        # The inventory keeps the original URL; only the response points at the proxy
+        await image_proxy.rewrite_image_urls([result, product_info], str(http_request.base_url), LOOKUP_SERVICE_URL)
+        return result
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Service error: {str(e)}")
 
 @app.post("/api/items/manual")
 async def add_item_manual(request: ManualAddRequest, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            inventory_data = {
-                "barcode": request.barcode,
-                "name": request.name,
-                "brand": request.brand,
-                "image_url": None,
-                "category": request.category,
-                "location": request.location,
-                "quantity": request.quantity,
-                "expiry_date": request.expiry_date,
-                "notes": request.notes,
-                "manually_added": True
-            }
-            response = await client.post(f"{INVENTORY_SERVICE_URL}/items", json=inventory_data, timeout=5.0)
+        client = http_clients.get_client("inventory")
+        inventory_data = {
+            "barcode": request.barcode,
+            "name": request.name,
+            "brand": request.brand,
+            "image_url": None,
+            "category": request.category,
+            "location": request.location,
+            "quantity": request.quantity,
+            "expiry_date": request.expiry_date,
+            "notes": request.notes,
+            "manually_added": True
+        }
+        response = await client.post(f"{INVENTORY_SERVICE_URL}/items", json=inventory_data, timeout=5.0)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
+
+# Barcodes per call to the lookup service's batch endpoint (its LOOKUP_BATCH_MAX_SIZE)
+BULK_LOOKUP_CHUNK_SIZE = int(os.getenv("BULK_LOOKUP_CHUNK_SIZE", "100"))
+
+async def lookup_products(barcodes: List[str]) -> dict:
+    """Product info per barcode via the batch lookup endpoint; barcodes that fail are left out"""
+    client = http_clients.get_client("lookup")
+
+    async def lookup_chunk(chunk: List[str]) -> List[dict]:
+        try:
+            response = await client.post(f"{LOOKUP_SERVICE_URL}/lookup/batch", json={"barcodes": chunk}, timeout=30.0)
             response.raise_for_status()
-            return response.json()
+            return response.json().get("results", [])
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Batch lookup failed for {len(chunk)} barcodes: {e}")
+            return []
+
+    chunks = [barcodes[i:i + BULK_LOOKUP_CHUNK_SIZE] for i in range(0, len(barcodes), BULK_LOOKUP_CHUNK_SIZE)]
+    results = await asyncio.gather(*(lookup_chunk(chunk) for chunk in chunks))
+    return {product["barcode"]: product for chunk in results for product in chunk if product.get("found")}
+
+def bulk_item_data(item: BulkItem, product_info: Optional[dict]) -> dict:
+    """Inventory fields for a bulk create: explicit values first, then looked-up details"""
+    product_info = product_info or {}
+    return {
+        "barcode": item.barcode,
+        "name": item.name or product_info.get("name") or f"Unknown Product ({item.barcode})",
+        "brand": item.brand or product_info.get("brand"),
+        "image_url": product_info.get("image_url"),
+        "category": item.category or product_info.get("category") or "Uncategorized",
+        "location": item.location,
+        "quantity": item.quantity,
+        "expiry_date": item.expiry_date,
+        "notes": item.notes,
+        "manually_added": item.name is not None
+    }
+
+@app.post("/api/items/bulk")
+async def bulk_items(request: BulkItemsRequest, http_request: Request, auth = Depends(get_current_auth)):
+    """
+    Create, update, delete and adjust many items in one inventory transaction (e.g. unloading groceries)
+    Creates given only a barcode are resolved with batched lookups before anything is written
+    """
+    barcodes = list(dict.fromkeys(
+        op.item.barcode.strip() for op in request.operations
+        if op.op == "create" and op.item and op.item.barcode and not op.item.name
+    ))
+    products = await lookup_products(barcodes) if barcodes else {}
+
+    operations = []
+    for op in request.operations:
+        operation = op.dict(exclude_unset=True, exclude={"item"})
+        # Without a name or barcode there is nothing to create; the inventory reports it for this operation
+        if op.item is not None and (op.item.name or op.item.barcode):
+            barcode = op.item.barcode.strip() if op.item.barcode else None
+            operation["item"] = bulk_item_data(op.item, products.get(barcode))
+        operations.append(operation)
+
+    try:
+        client = http_clients.get_client("inventory")
+        response = await client.post(f"{INVENTORY_SERVICE_URL}/items/bulk",
+                                     json={"operations": operations, "atomic": request.atomic}, timeout=30.0)
+        if response.status_code in (400, 409, 422):
+            return JSONResponse(status_code=response.status_code, content=response.json())
+        response.raise_for_status()
+        result = response.json()
+        await image_proxy.rewrite_image_urls([r.get("item") for r in result["results"]],
+                                             str(http_request.base_url), LOOKUP_SERVICE_URL)
+        return result
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
 
 @app.get("/api/items")
-async def get_items(location: Optional[str] = None, search: Optional[str] = None, auth = Depends(get_current_auth)):
+async def get_items(
+    request: Request,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    auth = Depends(get_current_auth)
+):
     try:
         params = {}
         if location:
             params["location"] = location
         if search:
             params["search"] = search
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/items", params=params, timeout=5.0)
-            response.raise_for_status()
-            return response.json()
+        if limit:
+            params["limit"] = limit
+        if cursor:
+            params["cursor"] = cursor
+        if fields:
+            params["fields"] = fields
+        client = http_clients.get_client("inventory")
+        response = await client.get(f"{INVENTORY_SERVICE_URL}/items", params=params,
+                                    headers=conditional_headers(request), timeout=5.0)
+        if response.status_code == 304:
+            return Response(status_code=304, headers=validator_headers(response))
+        if response.status_code in (400, 422):
+            raise HTTPException(status_code=response.status_code, detail=response.json().get("detail"))
+        response.raise_for_status()
+        headers = {h: response.headers[h] for h in PAGINATION_HEADERS if h in response.headers}
+        headers.update(validator_headers(response))
+        if image_proxy.IMAGE_PROXY_ENABLED and b'"image_url":"http' in response.content:
+            items = await image_proxy.rewrite_image_urls(response.json(), str(request.base_url), LOOKUP_SERVICE_URL)
+            return JSONResponse(content=items, headers=headers)
+        # Nothing to rewrite: pass the body through as-is instead of re-parsing and re-serializing it
+        return Response(content=response.content, media_type="application/json", headers=headers)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
+
+@app.get("/api/items/changes")
+async def get_item_changes(request: Request, since: int = 0, limit: Optional[int] = None,
+                           auth = Depends(get_current_auth)):
+    """Delta sync: items changed and ids deleted since an inventory version (see the inventory service)"""
+    try:
+        params = {"since": since}
+        if limit:
+            params["limit"] = limit
+        client = http_clients.get_client("inventory")
+        response = await client.get(f"{INVENTORY_SERVICE_URL}/items/changes", params=params, timeout=10.0)
+        if response.status_code == 422:
+            raise HTTPException(status_code=422, detail=response.json().get("detail"))
+        response.raise_for_status()
+        if image_proxy.IMAGE_PROXY_ENABLED and b'"image_url":"http' in response.content:
+            changes = response.json()
+            changes["items"] = await image_proxy.rewrite_image_urls(changes["items"], str(request.base_url),
+                                                                    LOOKUP_SERVICE_URL)
+            return changes
+        return Response(content=response.content, media_type="application/json")
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
 
 @app.get("/api/items/{item_id}")
-async def get_item(item_id: int, auth = Depends(get_current_auth)):
+async def get_item(item_id: int, request: Request, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/items/{item_id}", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
+        client = http_clients.get_client("inventory")
+        response = await client.get(f"{INVENTORY_SERVICE_URL}/items/{item_id}",
+                                    headers=conditional_headers(request), timeout=5.0)
+        if response.status_code == 304:
+            return Response(status_code=304, headers=validator_headers(response))
+        response.raise_for_status()
+        item = response.json()
+        await image_proxy.rewrite_image_urls([item], str(request.base_url), LOOKUP_SERVICE_URL)
+        return JSONResponse(content=item, headers=validator_headers(response))
     except httpx.HTTPError as e:
         if e.response.status_code == 404:
             raise HTTPException(status_code=404, detail="Item not found")
@@ -544,150 +801,135 @@ async def get_item(item_id: int, auth = Depends(get_current_auth)):
 @app.put("/api/items/{item_id}")
 async def update_item(item_id: int, request: UpdateItemRequest, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.put(f"{INVENTORY_SERVICE_URL}/items/{item_id}", json=request.dict(exclude_unset=True), timeout=5.0)
-            response.raise_for_status()
-            return response.json()
+        client = http_clients.get_client("inventory")
+        response = await client.put(f"{INVENTORY_SERVICE_URL}/items/{item_id}", json=request.dict(exclude_unset=True), timeout=5.0)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         if e.response.status_code == 404:
             raise HTTPException(status_code=404, detail="Item not found")
         raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
 
+@app.patch("/api/items/{item_id}/quantity")
+async def adjust_quantity(item_id: int, request: QuantityChangeRequest, auth = Depends(get_current_auth)):
+    """Change an item's quantity by delta without sending the whole item"""
+    try:
+        client = http_clients.get_client("inventory")
+        response = await client.patch(f"{INVENTORY_SERVICE_URL}/items/{item_id}/quantity", json=request.dict(), timeout=5.0)
+        if response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Item not found")
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
+
 @app.get("/api/export/csv")
 async def export_csv(auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/export/csv", timeout=30.0)
-            response.raise_for_status()
-            return Response(
-                content=response.content,
-                media_type="text/csv",
-                headers={"Content-Disposition": response.headers.get("Content-Disposition", "attachment; filename=pantrypal_export.csv")}
-            )
+        client = http_clients.get_client("inventory")
+        upstream_request = client.build_request("GET", f"{INVENTORY_SERVICE_URL}/export/csv", timeout=30.0)
+        response = await client.send(upstream_request, stream=True)
+        if response.is_error:
+            await response.aclose()
+        response.raise_for_status()
+        # Relay chunks as they arrive instead of buffering the whole file
+        return StreamingResponse(
+            response.aiter_bytes(),
+            media_type="text/csv",
+            headers={"Content-Disposition": response.headers.get("Content-Disposition", "attachment; filename=pantrypal_export.csv")},
+            background=BackgroundTask(response.aclose)
+        )
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
 
 @app.delete("/api/items/{item_id}")
 async def delete_item(item_id: int, auth = Depends(get_current_auth)):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(f"{INVENTORY_SERVICE_URL}/items/{item_id}", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
+        client = http_clients.get_client("inventory")
+        response = await client.delete(f"{INVENTORY_SERVICE_URL}/items/{item_id}", timeout=5.0)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         if e.response.status_code == 404:
             raise HTTPException(status_code=404, detail="Item not found")
         raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
 
 @app.get("/api/locations")
-async def get_locations(auth = Depends(get_current_auth)):
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/locations", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPError as e:
-        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
+async def get_locations(request: Request, auth = Depends(get_current_auth)):
+    return await proxy_inventory_get("/locations", request)
 
 @app.get("/api/categories")
-async def get_categories(auth = Depends(get_current_auth)):
+async def get_categories(request: Request, auth = Depends(get_current_auth)):
+    return await proxy_inventory_get("/categories", request)
+    
+@app.get("/api/events")
+async def get_events(request: Request, since: Optional[int] = None, auth = Depends(get_current_auth)):
+    """Server-Sent Events feed of inventory changes, relayed from the inventory service as it arrives"""
+    params = {"since": since} if since is not None else {}
+    forward = {h: request.headers[h] for h in ("last-event-id",) if h in request.headers}
+    client = http_clients.get_client("events")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/categories", timeout=5.0)
-            response.raise_for_status()
-            return response.json()
+        upstream = await client.send(
+            client.build_request("GET", f"{INVENTORY_SERVICE_URL}/events", params=params, headers=forward,
+                                 timeout=httpx.Timeout(10.0, read=None)),
+            stream=True
+        )
+        if upstream.status_code != 200:
+            await upstream.aclose()
+            raise HTTPException(status_code=502, detail=f"Inventory service returned {upstream.status_code}")
     except httpx.HTTPError as e:
-        raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
-    
+        raise HTTPException(status_code=502, detail=f"Inventory service error: {str(e)}")
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(upstream.aclose)
+    )
+
 @app.get("/api/stats/expiring")
 async def get_expiring_items(days: int = 7, auth = Depends(get_current_auth)):
-    """Get items expiring within specified days"""
+    """Get items expiring within specified days, bucketed by the notification thresholds"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/items", timeout=5.0)
-            response.raise_for_status()
-            items = response.json()
-            
-            items_with_expiry = [item for item in items if item.get('expiry_date')]
-            today = datetime.now().date()
-            
-            expired = []
-            critical = []  
-            warning = []   
-            upcoming = []  
-            
-            for item in items_with_expiry:
-                try:
-                    expiry_date = datetime.fromisoformat(item['expiry_date']).date()
-                    days_until = (expiry_date - today).days
-                    
-                    item_info = {
-                        'id': item['id'],
-                        'name': item['name'],
-                        'brand': item.get('brand'),
-                        'location': item['location'],
-                        'category': item.get('category', 'Uncategorized'),
-                        'quantity': item['quantity'],
-                        'expiry_date': item['expiry_date'],
-                        'days_until_expiry': days_until
-                    }
-                    
-                    if days_until < 0:
-                        expired.append(item_info)
-                    elif days_until <= 3:
-                        critical.append(item_info)
-                    elif days_until <= 7:
-                        warning.append(item_info)
-                    elif days_until <= days:
-                        upcoming.append(item_info)
-                        
-                except (ValueError, TypeError):
-                    continue
-            
-            expired.sort(key=lambda x: x['days_until_expiry'])
-            critical.sort(key=lambda x: x['days_until_expiry'])
-            warning.sort(key=lambda x: x['days_until_expiry'])
-            upcoming.sort(key=lambda x: x['days_until_expiry'])
-            
-            return {
-                'summary': {
-                    'expired': len(expired),
-                    'critical': len(critical),
-                    'warning': len(warning),
-                    'upcoming': len(upcoming),
-                    'total_expiring': len(expired) + len(critical) + len(warning)
-                },
-                'items': {
-                    'expired': expired,
-                    'critical': critical,
-                    'warning': warning,
-                    'upcoming': upcoming
-                },
-                'generated_at': datetime.now().isoformat()
-            }
-            
+        preferences = load_notification_preferences()
+    except Exception:
+        preferences = DEFAULT_NOTIFICATION_PREFERENCES
+    try:
+        params = {
+            "days": days,
+            "critical_threshold": preferences.get("critical_threshold", 3),
+            "warning_threshold": preferences.get("warning_threshold", 7)
+        }
+        client = http_clients.get_client("inventory")
+        response = await client.get(f"{INVENTORY_SERVICE_URL}/items/expiring/summary", params=params, timeout=5.0)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Inventory service error: {str(e)}")
 
+NOTIFICATION_PREFERENCES_FILE = '/app/data/notification_preferences.json'
+
+DEFAULT_NOTIFICATION_PREFERENCES = {
+    'mobile_enabled': False,
+    'notification_time': '09:00',
+    'critical_threshold': 3,
+    'warning_threshold': 7,
+    'home_assistant_enabled': False
+}
+
+def load_notification_preferences() -> dict:
+    """Load saved notification preferences, falling back to defaults"""
+    import json
+    if os.path.exists(NOTIFICATION_PREFERENCES_FILE):
+        with open(NOTIFICATION_PREFERENCES_FILE, 'r') as f:
+            return json.load(f)
+    return dict(DEFAULT_NOTIFICATION_PREFERENCES)
+
 @app.get("/api/notifications/preferences")
 async def get_notification_preferences(auth = Depends(get_current_auth)):
     """Get notification preferences"""
     try:
-        import json
-        prefs_file = '/app/data/notification_preferences.json'
-        os.makedirs(os.path.dirname(prefs_file), exist_ok=True)
-        
-        if os.path.exists(prefs_file):
-            with open(prefs_file, 'r') as f:
-                return json.load(f)
-        else:
-            return {
-                'mobile_enabled': False,
-                'notification_time': '09:00',
-                'critical_threshold': 3,
-                'warning_threshold': 7,
-                'home_assistant_enabled': False
-            }
+        os.makedirs(os.path.dirname(NOTIFICATION_PREFERENCES_FILE), exist_ok=True)
+        return load_notification_preferences()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get preferences: {str(e)}")
 
@@ -696,10 +938,9 @@ async def save_notification_preferences(preferences: dict, auth = Depends(get_cu
     """Save notification preferences"""
     try:
         import json
-        prefs_file = '/app/data/notification_preferences.json'
-        os.makedirs(os.path.dirname(prefs_file), exist_ok=True)
+        os.makedirs(os.path.dirname(NOTIFICATION_PREFERENCES_FILE), exist_ok=True)
         
-        with open(prefs_file, 'w') as f:
+        with open(NOTIFICATION_PREFERENCES_FILE, 'w') as f:
             json.dump(preferences, f, indent=2)
         
         return {'status': 'success', 'preferences': preferences}
@@ -781,6 +1022,9 @@ async def update_my_profile(
     conn.commit()
     conn.close()
     
+    # Drop cached sessions so the new profile is returned immediately
+    user_db.invalidate_user_sessions(auth["id"])
+    
     return {"message": "Profile updated successfully"}
 
 @app.post("/api/users/me/change-password")
@@ -897,6 +1141,9 @@ async def update_user(
     conn.commit()
     conn.close()
     
+    # Drop cached sessions so deactivation takes effect immediately
+    user_db.invalidate_user_sessions(user_id)
+    
     return {"message": "User updated successfully"}
 
 @app.post("/api/admin/users/{user_id}/reset-password")
@@ -944,6 +1191,19 @@ async def get_admin_stats(auth = Depends(require_admin)):
         "admin_users": admin_users
     }
 
+@app.get("/api/debug/upstreams")
+async def debug_upstreams():
+    """Debug endpoint to check upstream connection pools and request metrics"""
+    return http_clients.pool_stats()
+
+@app.get("/api/debug/auth-cache")
+async def debug_auth_cache():
+    """Debug endpoint to check in-memory auth cache sizes and hit rates"""
+    return {
+        "api_keys": auth_db.api_key_cache_stats(),
+        "sessions": user_db.session_cache_stats()
+    }
+
 @app.get("/api/debug/network")
 async def debug_network(request: Request):
     """Debug endpoint to check IP and network status"""
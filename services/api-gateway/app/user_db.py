@@ -1,9 +1,11 @@
 import sqlite3
 import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Optional, Dict
 from passlib.context import CryptContext
 import os
+from .ttl_cache import TTLCache
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,6 +13,18 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # Database path
 DB_PATH = os.getenv("USERS_DB_PATH", "/app/data/users.db")
 
+# Validated sessions, keyed by session token (avoids a DB read per request)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "30"))
+_session_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+# Pending last_used_at updates (session id -> timestamp), written in batches
+SESSION_FLUSH_INTERVAL = int(os.getenv("SESSION_FLUSH_INTERVAL", "30"))
+_pending_activity: Dict[int, datetime] = {}
+_activity_lock = threading.Lock()
+_flusher_stop = threading.Event()
+_flusher_thread: Optional[threading.Thread] = None
+
 
 def get_db():
     """Get database connection"""
@@ -191,11 +205,77 @@ def create_session(user_id: int, ip_address: Optional[str] = None,
     return session_token
 
 
+def _record_activity(session_id: int):
+    """Queue a last_used_at update for the write-behind flusher"""
+    with _activity_lock:
+        _pending_activity[session_id] = datetime.now()
+
+
+def flush_session_activity() -> int:
+    """
+    Write all queued last_used_at updates in a single transaction
+    Returns number of sessions updated
+    """
+    global _pending_activity
+    with _activity_lock:
+        pending, _pending_activity = _pending_activity, {}
+    
+    if not pending:
+        return 0
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        UPDATE sessions
+        SET last_used_at = ?
+        WHERE id = ?
+    """, [(last_used_at, session_id) for session_id, last_used_at in pending.items()])
+    conn.commit()
+    conn.close()
+    
+    return len(pending)
+
+
+def _flusher_loop():
+    while not _flusher_stop.wait(SESSION_FLUSH_INTERVAL):
+        try:
+            flush_session_activity()
+        except Exception as e:
+            print(f"Failed to flush session activity: {e}")
+
+
+def start_activity_flusher():
+    """Start the background thread that periodically flushes session activity"""
+    global _flusher_thread
+    if _flusher_thread and _flusher_thread.is_alive():
+        return
+    _flusher_stop.clear()
+    _flusher_thread = threading.Thread(target=_flusher_loop, name="session-activity-flusher", daemon=True)
+    _flusher_thread.start()
+
+
+def stop_activity_flusher():
+    """Stop the flusher thread and write any remaining updates"""
+    _flusher_stop.set()
+    if _flusher_thread:
+        _flusher_thread.join(timeout=5)
+    flush_session_activity()
+
+
 def validate_session(session_token: str) -> Optional[Dict]:
     """
     Validate a session token and return user info
-    Updates last_used_at timestamp
+    Served from a short-lived cache when possible; last_used_at is
+    updated in batches by the activity flusher instead of per request
     """
+    cached = _session_cache.get(session_token)
+    if cached:
+        if datetime.now() > cached['expires_at']:
+            _session_cache.pop(session_token)
+        else:
+            _record_activity(cached['session_id'])
+            return dict(cached['user'])
+    
     conn = get_db()
     cursor = conn.cursor()
     
@@ -226,13 +306,8 @@ def validate_session(session_token: str) -> Optional[Dict]:
         conn.close()
         return None
     
-    # Update last used
-    cursor.execute("""
-        UPDATE sessions
-        SET last_used_at = ?
-        WHERE id = ?
-    """, (datetime.now(), session['id']))
-    conn.commit()
+    conn.close()
+    _record_activity(session['id'])
     
     # FIXED: Return "id" instead of "user_id" for consistency with main.py
     result = {
@@ -243,8 +318,29 @@ def validate_session(session_token: str) -> Optional[Dict]:
         "is_admin": bool(session['is_admin'])
     }
     
-    conn.close()
-    return result
+    _session_cache.set(session_token, {
+        "session_id": session['id'],
+        "expires_at": expires_at,
+        "user": result,
+    })
+    return dict(result)
+
+
+def invalidate_user_sessions(user_id: int) -> int:
+    """
+    Drop a user's sessions from the validation cache
+    Call after changing a user's status or profile so the change applies immediately
+    """
+    return _session_cache.pop_where(lambda entry: entry['user']['id'] == user_id)
+
+
+def session_cache_stats() -> Dict:
+    """Session cache size, hit/miss counters and pending activity writes"""
+    stats = _session_cache.stats()
+    with _activity_lock:
+        stats["pending_activity_updates"] = len(_pending_activity)
+    stats["flush_interval_seconds"] = SESSION_FLUSH_INTERVAL
+    return stats
 
 
 def delete_session(session_token: str) -> bool:
@@ -258,6 +354,7 @@ def delete_session(session_token: str) -> bool:
     conn.commit()
     conn.close()
     
+    _session_cache.pop(session_token)
     return rows_affected > 0
 
 
@@ -272,6 +369,7 @@ def delete_user_sessions(user_id: int) -> int:
     conn.commit()
     conn.close()
     
+    invalidate_user_sessions(user_id)
     return rows_affected
 
 
@@ -334,6 +432,7 @@ def delete_user(user_id: int) -> bool:
     conn.commit()
     conn.close()
     
+    invalidate_user_sessions(user_id)
     return rows_affected > 0
 
 
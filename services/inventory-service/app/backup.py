@@ -0,0 +1,301 @@
+"""
+Snapshot backups for the inventory database
+
+A backup chain is a full snapshot (SQLite online backup API) followed by
+incremental change logs holding rows whose updated_date moved since the
+previous backup, plus the ids present at that time so deletes can be
+replayed. Every file is compressed and recorded in manifest.json, so
+retention and restore never need to list or parse the backup directory.
+
+Restore from the command line:
+    python -m app.backup restore /path/to/restored.db [--at 2024-01-31T02:00:00]
+"""
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine, select, Date, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def _zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def resolve_compression(compression: str) -> str:
+    """Validate BACKUP_COMPRESSION, falling back to gzip when zstd isn't installed"""
+    compression = (compression or "gzip").lower()
+    if compression not in COMPRESSION_EXTENSIONS:
+        logger.warning(f"Unknown backup compression '{compression}', using gzip")
+        return "gzip"
+    if compression == "zstd" and not _zstd_available():
+        logger.warning("BACKUP_COMPRESSION=zstd but the 'zstandard' package is not installed, using gzip")
+        return "gzip"
+    return compression
+
+
+def _compression_for(filename: str) -> str:
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if extension and filename.endswith(extension):
+            return compression
+    return "none"
+
+
+def open_compressed(path: str, mode: str):
+    """Open a (possibly compressed) backup file; compression is picked from the extension"""
+    compression = _compression_for(path)
+    if compression == "gzip":
+        return gzip.open(path, mode)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+# ----------------------------------------------------------------------------
+# Manifest
+# ----------------------------------------------------------------------------
+
+def load_manifest(backup_path: str) -> Dict:
+    manifest_path = os.path.join(backup_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"version": MANIFEST_VERSION, "backups": []}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(backup_path: str, manifest: Dict):
+    """Write the manifest atomically so a crash never leaves it half written"""
+    manifest_path = os.path.join(backup_path, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _chains(manifest: Dict) -> List[List[Dict]]:
+    """Group manifest entries into [full, incremental, ...] chains, oldest first"""
+    chains = []
+    for entry in manifest["backups"]:
+        if entry["type"] == "full" or not chains:
+            chains.append([entry])
+        else:
+            chains[-1].append(entry)
+    return chains
+
+
+# ----------------------------------------------------------------------------
+# Creating backups
+# ----------------------------------------------------------------------------
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+
+def create_snapshot(engine, filepath: str):
+    """Consistent copy of the live database using SQLite's online backup API"""
+    tmp_db = filepath + ".tmp"
+    raw = engine.raw_connection()
+    try:
+        dest = sqlite3.connect(tmp_db)
+        try:
+            raw.driver_connection.backup(dest)
+        finally:
+            dest.close()
+    finally:
+        raw.close()
+
+    try:
+        with open(tmp_db, "rb") as src, open_compressed(filepath, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    finally:
+        os.remove(tmp_db)
+
+
+def create_change_log(engine, table, since: datetime, filepath: str) -> int:
+    """Write rows updated after `since` (and all current ids) as compressed JSON lines"""
+    rows = 0
+    with engine.connect() as conn, open_compressed(filepath, "wt") as f:
+        ids = conn.execute(select(table.c.id)).scalars().all()
+        f.write(json.dumps({"ids": ids}) + "\n")
+
+        changed = conn.execution_options(stream_results=True).execute(
+            select(table).where(table.c.updated_date > since).order_by(table.c.id)
+        )
+        for row in changed:
+            f.write(json.dumps(dict(row._mapping), default=_json_default) + "\n")
+            rows += 1
+    return rows
+
+
+def _unique_filename(backup_path: str, prefix: str, timestamp: str, suffix: str) -> str:
+    filename = f"{prefix}_{timestamp}{suffix}"
+    counter = 1
+    while os.path.exists(os.path.join(backup_path, filename)):
+        filename = f"{prefix}_{timestamp}_{counter}{suffix}"
+        counter += 1
+    return filename
+
+
+def run_snapshot_backup(engine, table, backup_path: str, compression: str = "gzip",
+                        full_every: int = 7) -> Dict:
+    """
+    Take the next backup in the chain: a full snapshot when there is no chain
+    yet or the current one has full_every entries, otherwise a change log
+    """
+    os.makedirs(backup_path, exist_ok=True)
+    compression = resolve_compression(compression)
+    extension = COMPRESSION_EXTENSIONS[compression]
+
+    manifest = load_manifest(backup_path)
+    chains = _chains(manifest)
+    started_at = datetime.utcnow()
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H%M%S')
+
+    if not chains or len(chains[-1]) >= full_every:
+        filename = _unique_filename(backup_path, "pantrypal_snapshot", timestamp, f".db{extension}")
+        create_snapshot(engine, os.path.join(backup_path, filename))
+        entry = {"type": "full", "file": filename}
+    else:
+        since = datetime.fromisoformat(chains[-1][-1]["watermark"])
+        filename = _unique_filename(backup_path, "pantrypal_changes", timestamp, f".jsonl{extension}")
+        rows = create_change_log(engine, table, since, os.path.join(backup_path, filename))
+        entry = {"type": "incremental", "file": filename, "base": chains[-1][0]["file"],
+                 "since": since.isoformat(), "rows": rows}
+
+    entry["created_at"] = datetime.now().isoformat()
+    # Rows updated after this point belong to the next change log
+    entry["watermark"] = started_at.isoformat()
+    entry["size"] = os.path.getsize(os.path.join(backup_path, filename))
+
+    manifest["backups"].append(entry)
+    save_manifest(backup_path, manifest)
+    return entry
+
+
+def prune_backups(backup_path: str, retention_days: int) -> List[str]:
+    """
+    Delete whole chains whose newest entry is past retention
+    The latest chain is always kept so a restore point exists
+    """
+    manifest = load_manifest(backup_path)
+    chains = _chains(manifest)
+    cutoff = datetime.now() - timedelta(days=retention_days)
+
+    kept, removed = [], []
+    for index, chain in enumerate(chains):
+        is_latest = index == len(chains) - 1
+        if not is_latest and datetime.fromisoformat(chain[-1]["created_at"]) < cutoff:
+            for entry in chain:
+                filepath = os.path.join(backup_path, entry["file"])
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                removed.append(entry["file"])
+        else:
+            kept.extend(chain)
+
+    if removed:
+        manifest["backups"] = kept
+        save_manifest(backup_path, manifest)
+    return removed
+
+
+# ----------------------------------------------------------------------------
+# Restore
+# ----------------------------------------------------------------------------
+
+def _parse_row(table, row: Dict) -> Dict:
+    values = {}
+    for column in table.columns:
+        value = row.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        values[column.name] = value
+    return values
+
+
+def apply_change_log(conn, table, filepath: str):
+    with open_compressed(filepath, "rt") as f:
+        ids = json.loads(f.readline())["ids"]
+        for line in f:
+            values = _parse_row(table, json.loads(line))
+            stmt = sqlite_insert(table).values(**values)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={k: v for k, v in values.items() if k != "id"}
+            ))
+
+    # Rows missing from the id list were deleted after the previous backup
+    conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS restore_ids (id INTEGER PRIMARY KEY)")
+    conn.exec_driver_sql("DELETE FROM restore_ids")
+    if ids:
+        conn.exec_driver_sql("INSERT INTO restore_ids (id) VALUES (?)", [(i,) for i in ids])
+    conn.exec_driver_sql(f"DELETE FROM {table.name} WHERE id NOT IN (SELECT id FROM restore_ids)")
+
+
+def restore_backup(backup_path: str, target_db: str, table, at: Optional[datetime] = None) -> List[str]:
+    """
+    Rebuild a database file from the newest chain at or before `at`
+    Returns the backup files that were applied
+    """
+    if os.path.exists(target_db):
+        raise FileExistsError(f"Refusing to overwrite existing file: {target_db}")
+
+    entries = [e for chain in _chains(load_manifest(backup_path)) for e in chain]
+    if at:
+        entries = [e for e in entries if datetime.fromisoformat(e["created_at"]) <= at]
+    fulls = [i for i, e in enumerate(entries) if e["type"] == "full"]
+    if not fulls:
+        raise FileNotFoundError("No snapshot available to restore from")
+    chain = entries[fulls[-1]:]
+
+    with open_compressed(os.path.join(backup_path, chain[0]["file"]), "rb") as src, open(target_db, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    engine = create_engine(f"sqlite:///{target_db}")
+    try:
+        with engine.begin() as conn:
+            for entry in chain[1:]:
+                apply_change_log(conn, table, os.path.join(backup_path, entry["file"]))
+    finally:
+        engine.dispose()
+
+    return [entry["file"] for entry in chain]
+
+
+if __name__ == "__main__":
+    import argparse
+    from .main import ItemDB, BACKUP_PATH
+
+    parser = argparse.ArgumentParser(description="PantryPal snapshot backup tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    restore_parser = subparsers.add_parser("restore", help="Restore a database from snapshot backups")
+    restore_parser.add_argument("target", help="Path of the database file to create")
+    restore_parser.add_argument("--at", help="Restore the newest backup taken at or before this ISO timestamp")
+    restore_parser.add_argument("--backup-path", default=BACKUP_PATH)
+    args = parser.parse_args()
+
+    applied = restore_backup(
+        args.backup_path, args.target, ItemDB.__table__,
+        at=datetime.fromisoformat(args.at) if args.at else None
+    )
+    print(f"Restored {args.target} from: {', '.join(applied)}")
@@ -0,0 +1,123 @@
+"""
+In-process change feed for inventory items
+
+Writes made through the API publish item.created/item.updated/item.deleted
+events. Event ids are the inventory version after the write (the value the
+ETag of GET /items carries), so a client can load the list, then subscribe
+from its version without missing or repeating changes. Recent events live in
+a bounded ring buffer; a client resuming from further back than the buffer
+reaches gets a single "reset" event telling it to reload instead.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+_buffer: Deque[Dict] = deque(maxlen=EVENT_BUFFER_SIZE)
+# Events after this version are all in the buffer
+_floor: Optional[int] = None
+_subscribers: Set["Subscriber"] = set()
+_stats = {"published": 0, "dropped_subscribers": 0}
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+
+def init_event_feed(current_version: int):
+    """The buffer starts out complete from the version the service started at"""
+    global _floor
+    _floor = current_version
+
+
+def publish(event_type: str, seq: int, item_id: int, item: Optional[Dict] = None):
+    global _floor
+    event = {
+        "seq": seq,
+        "type": event_type,
+        "item_id": item_id,
+        "item": item,
+        "at": datetime.utcnow().isoformat(),
+    }
+    if len(_buffer) == _buffer.maxlen:
+        _floor = _buffer[0]["seq"]
+    _buffer.append(event)
+    _stats["published"] += 1
+
+    for subscriber in list(_subscribers):
+        try:
+            subscriber.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Close slow clients instead of buffering for them; they resume via Last-Event-ID
+            subscriber.overflowed = True
+            _subscribers.discard(subscriber)
+            _stats["dropped_subscribers"] += 1
+
+
+def events_since(since: int) -> Optional[List[Dict]]:
+    """Buffered events after since, or None if the buffer no longer reaches back that far"""
+    if _floor is None or since < _floor:
+        return None
+    return [event for event in _buffer if event["seq"] > since]
+
+
+def _format(event: Dict) -> str:
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream_events(since: int, current_version: int) -> AsyncIterator[str]:
+    """
+    Server-Sent Events: everything after since, then live events
+    A comment line is sent every EVENT_HEARTBEAT_SECONDS to keep proxies from closing the stream
+    """
+    subscriber = Subscriber()
+    _subscribers.add(subscriber)
+    try:
+        yield "retry: 3000\n\n"
+        # Subscribed before reading the backlog, so nothing published in between is lost
+        last_seq = since
+        backlog = events_since(since)
+        if backlog is None:
+            yield _format({"seq": current_version, "type": "reset", "item_id": None, "item": None,
+                           "at": datetime.utcnow().isoformat()})
+            last_seq = current_version
+            backlog = events_since(current_version) or []
+        for event in backlog:
+            yield _format(event)
+            last_seq = event["seq"]
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if subscriber.overflowed:
+                return
+            # Skip events already sent from the backlog
+            if event["seq"] > last_seq:
+                yield _format(event)
+                last_seq = event["seq"]
+    finally:
+        _subscribers.discard(subscriber)
+
+
+def event_stats() -> Dict:
+    return {
+        "subscribers": len(_subscribers),
+        "buffered": len(_buffer),
+        "buffer_size": EVENT_BUFFER_SIZE,
+        "resumable_from": _floor,
+        **_stats,
+    }
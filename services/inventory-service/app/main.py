@@ -1,17 +1,25 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Date
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Date, Index, and_, or_, literal_column, text, func, insert, update, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime, date, timedelta
-from typing import Optional, List
+from typing import Optional, List, Literal
 from pydantic import BaseModel
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import os
 import csv
 import io
+import base64
 import logging
+from .search import FTS_COLUMNS, init_search_index, search_subquery
+from .versioning import (init_version_tracking, check_not_modified, get_version, get_tombstone_floor,
+                         compact_tombstones)
+from .events import init_event_feed, publish, stream_events, event_stats
+from .sqlite_tuning import apply_tuning
+from . import backup
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,6 +28,7 @@ app = FastAPI(title="PantryPal Inventory Service", version="1.0.0")
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///data/inventory.db")
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+apply_tuning(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -27,6 +36,13 @@ BACKUP_ENABLED = os.getenv("BACKUP_ENABLED", "false").lower() == "true"
 BACKUP_SCHEDULE = os.getenv("BACKUP_SCHEDULE", "0 2 * * *")
 BACKUP_RETENTION_DAYS = int(os.getenv("BACKUP_RETENTION_DAYS", "7"))
 BACKUP_PATH = os.getenv("BACKUP_PATH", "/app/backups")
+# csv: full CSV dump every run; snapshot: SQLite snapshots + incremental change logs
+BACKUP_MODE = os.getenv("BACKUP_MODE", "csv").lower()
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip").lower()
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "7"))
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "1000"))
+# Deletion tombstones for /items/changes are compacted on this schedule (see TOMBSTONE_RETENTION_DAYS)
+TOMBSTONE_COMPACT_SCHEDULE = os.getenv("TOMBSTONE_COMPACT_SCHEDULE", "30 3 * * *")
 
 class ItemDB(Base):
     __tablename__ = "items"
@@ -38,14 +54,30 @@ class ItemDB(Base):
     category = Column(String, default="Uncategorized")
     location = Column(String, default="Basement Pantry")
     quantity = Column(Integer, default=1)
-    expiry_date = Column(Date, nullable=True)
+    expiry_date = Column(Date, nullable=True, index=True)
     notes = Column(String, nullable=True)
     manually_added = Column(Boolean, default=False)
     added_date = Column(DateTime, default=datetime.utcnow)
     updated_date = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset pagination order for GET /items
+        Index("ix_items_updated_date_id", "updated_date", "id"),
+        # Merge-on-scan lookup for POST /items?merge=true
+        Index("ix_items_barcode_location_expiry", "barcode", "location", "expiry_date"),
+    )
+
 Base.metadata.create_all(bind=engine)
 
+def ensure_indexes():
+    """Create indexes added after the table was first created (create_all skips existing tables)"""
+    for index in ItemDB.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+ensure_indexes()
+init_search_index(engine)
+init_version_tracking(engine)
+
 class ItemCreate(BaseModel):
     barcode: Optional[str] = None
     name: str
@@ -85,6 +117,21 @@ class ItemResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class QuantityChange(BaseModel):
+    delta: int
+
+class BulkOperation(BaseModel):
+    op: Literal["create", "update", "delete", "adjust"]
+    id: Optional[int] = None  # update, delete, adjust
+    item: Optional[ItemCreate] = None  # create
+    changes: Optional[ItemUpdate] = None  # update
+    delta: Optional[int] = None  # adjust: added to quantity, which stops at 0
+
+class BulkRequest(BaseModel):
+    operations: List[BulkOperation]
+    # Roll everything back if any operation fails, instead of applying the rest
+    atomic: bool = False
+
 def get_db():
     db = SessionLocal()
     try:
@@ -92,28 +139,311 @@ def get_db():
     finally:
         db.close()
 
+def publish_item_event(db: Session, event_type: str, item_id: int, db_item=None):
+    """Publish a committed change to the event feed, tagged with the new inventory version"""
+    item = jsonable_encoder(ItemResponse.model_validate(db_item)) if db_item is not None else None
+    publish(event_type, get_version(db)[0], item_id, item)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "inventory-service", "timestamp": datetime.utcnow().isoformat()}
 
+def adjusted_quantity(delta: int):
+    """SQL expression for the stored quantity plus delta, stopping at 0"""
+    return func.max(ItemDB.quantity + delta, 0)
+
+def merge_scanned_item(db: Session, item: ItemCreate) -> Optional[ItemDB]:
+    """
+    Add the quantity to an existing row with the same barcode, location and expiry date
+    Done as one UPDATE ... RETURNING, so concurrent scans can't lose an increment; None if nothing matched
+    """
+    match = db.query(ItemDB.id).filter(
+        ItemDB.barcode == item.barcode,
+        ItemDB.location == item.location,
+        ItemDB.expiry_date.is_(None) if item.expiry_date is None else ItemDB.expiry_date == item.expiry_date
+    ).order_by(ItemDB.id).limit(1).scalar_subquery()
+    return db.scalars(
+        update(ItemDB).where(ItemDB.id == match)
+        .values(quantity=ItemDB.quantity + item.quantity, updated_date=datetime.utcnow())
+        .returning(ItemDB)
+    ).first()
+
 @app.post("/items", response_model=ItemResponse)
-async def create_item(item: ItemCreate, db: Session = Depends(get_db)):
+async def create_item(item: ItemCreate, response: Response, merge: bool = False, db: Session = Depends(get_db)):
+    """
+    Add an item
+    With merge=true, scanning a barcode already stored in the same location with the same
+    expiry date increases that row's quantity instead (X-Merged: true) of adding a row
+    """
+    if merge and item.barcode:
+        db_item = merge_scanned_item(db, item)
+        response.headers["X-Merged"] = "true" if db_item else "false"
+        if db_item:
+            db.commit()
+            db.refresh(db_item)
+            publish_item_event(db, "item.updated", db_item.id, db_item)
+            return db_item
     db_item = ItemDB(**item.dict())
     db.add(db_item)
     db.commit()
     db.refresh(db_item)
+    publish_item_event(db, "item.created", db_item.id, db_item)
     return db_item
 
+def bulk_operation_error(op: BulkOperation) -> Optional[str]:
+    if op.op == "create":
+        return None if op.item is not None else "item is required"
+    if op.id is None:
+        return "id is required"
+    if op.op == "update" and op.changes is None:
+        return "changes is required"
+    if op.op == "adjust" and op.delta is None:
+        return "delta is required"
+    return None
+
+def publish_bulk_events(db: Session, events: dict):
+    """Publish one event per item touched by a bulk request, in the order the versions were assigned"""
+    ids = list(events)
+    versions = dict(db.query(ItemDB.id, literal_column("items.version")).filter(ItemDB.id.in_(ids)).all())
+    versions.update(db.execute(
+        text("SELECT item_id, version FROM item_tombstones WHERE item_id IN :ids").bindparams(
+            bindparam("ids", expanding=True)),
+        {"ids": ids}
+    ).all())
+    for item_id in sorted(ids, key=lambda i: versions.get(i, 0)):
+        event_type, item = events[item_id]
+        publish(event_type, versions.get(item_id, 0), item_id, item)
+
+@app.post("/items/bulk")
+async def bulk_items(request: BulkRequest, db: Session = Depends(get_db)):
+    """
+    Apply many create/update/delete/adjust operations in one transaction
+    Creates go in as a single multi-row insert; results come back per operation, in request order
+    """
+    operations = request.operations
+    if len(operations) > BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_OPERATIONS} operations per request")
+
+    ids = {op.id for op in operations if op.op != "create" and op.id is not None}
+    items = {item.id: item for item in db.query(ItemDB).filter(ItemDB.id.in_(ids))} if ids else {}
+    results = [None] * len(operations)
+    creates = []
+    # item id -> event type of its last successful operation
+    touched = {}
+
+    for index, op in enumerate(operations):
+        error = bulk_operation_error(op)
+        if error is None and op.op != "create" and op.id not in items:
+            error = "Item not found"
+        if error:
+            results[index] = {"index": index, "op": op.op, "status": "error", "id": op.id, "error": error}
+            continue
+
+        results[index] = {"index": index, "op": op.op, "status": "ok", "id": op.id}
+        if op.op == "create":
+            creates.append((index, op.item.dict()))
+            continue
+
+        db_item = items[op.id]
+        if op.op == "delete":
+            db.delete(db_item)
+            del items[op.id]
+            touched[op.id] = "item.deleted"
+            continue
+        if op.op == "update":
+            for field, value in op.changes.dict(exclude_unset=True).items():
+                setattr(db_item, field, value)
+        else:
+            # Evaluated by SQLite against the stored value; flushed now so a later adjust builds on it
+            db_item.quantity = adjusted_quantity(op.delta)
+        db_item.updated_date = datetime.utcnow()
+        db.flush()
+        touched.setdefault(op.id, "item.updated")
+
+    failed = sum(1 for result in results if result["status"] == "error")
+    if failed and request.atomic:
+        db.rollback()
+        return JSONResponse(status_code=409, content={
+            "committed": False, "succeeded": 0, "failed": failed, "results": results
+        })
+
+    if creates:
+        created = db.scalars(
+            insert(ItemDB).returning(ItemDB, sort_by_parameter_order=True),
+            [values for _, values in creates]
+        ).all()
+        for (index, _), db_item in zip(creates, created):
+            results[index]["id"] = db_item.id
+            items[db_item.id] = db_item
+            touched[db_item.id] = "item.created"
+
+    # Every result shows the item as the whole request left it (None if a later operation deleted it)
+    serialized = {item_id: jsonable_encoder(ItemResponse.model_validate(items[item_id]))
+                  for item_id in touched if item_id in items}
+    for result in results:
+        if result["status"] == "ok" and result["op"] != "delete":
+            result["item"] = serialized.get(result["id"])
+    db.commit()
+
+    publish_bulk_events(db, {item_id: (event_type, serialized.get(item_id)) for item_id, event_type in touched.items()})
+    return {"committed": True, "succeeded": len(results) - failed, "failed": failed, "results": results}
+
+ITEM_FIELDS = list(ItemResponse.model_fields.keys())
+
+def encode_cursor(sort_value, item_id: int) -> str:
+    """Opaque keyset cursor pointing just after the given (sort value, id)"""
+    if isinstance(sort_value, datetime):
+        raw = f"d|{sort_value.isoformat()}|{item_id}"
+    else:
+        raw = f"r|{sort_value!r}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, ranked: bool):
+    try:
+        kind, sort_value, item_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if kind != ("r" if ranked else "d"):
+            raise ValueError("cursor does not match this query")
+        value = float(sort_value) if ranked else datetime.fromisoformat(sort_value)
+        return value, int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in ITEM_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def search_filter(search: str):
+    """Substring scan used when the full-text index can't answer a search"""
+    search_term = f"%{search}%"
+    return or_(*(getattr(ItemDB, column).ilike(search_term) for column in FTS_COLUMNS))
+
 @app.get("/items", response_model=List[ItemResponse])
-async def get_items(location: Optional[str] = None, search: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(ItemDB)
+async def get_items(
+    request: Request,
+    response: Response,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    List items, newest first (best match first when searching)
+    Pass limit (and the X-Next-Cursor value as cursor) for keyset pagination,
+    and fields=a,b,c to return only those fields
+    """
+    not_modified, headers = check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+
+    selected = parse_fields(fields)
+    columns = [getattr(ItemDB, f) for f in selected] if selected else [ItemDB]
+    # Keyset columns are always loaded so the next cursor can be built
+    if selected:
+        columns += [getattr(ItemDB, f) for f in ("id", "updated_date") if f not in selected]
+
+    fts = search_subquery(search) if search else None
+    if fts is not None:
+        columns.append(fts.c.search_rank)
+
+    query = db.query(*columns)
     if location:
         query = query.filter(ItemDB.location == location)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter((ItemDB.name.ilike(search_term)) | (ItemDB.brand.ilike(search_term)) | (ItemDB.barcode.ilike(search_term)))
-    items = query.order_by(ItemDB.updated_date.desc()).all()
-    return items
+    if fts is not None:
+        query = query.join(fts, fts.c.item_id == ItemDB.id)
+    elif search:
+        query = query.filter(search_filter(search))
+
+    headers["X-Total-Count"] = str(query.order_by(None).count())
+
+    if fts is not None:
+        sort_column, sort_order = fts.c.search_rank, fts.c.search_rank.asc()
+    else:
+        sort_column, sort_order = ItemDB.updated_date, ItemDB.updated_date.desc()
+
+    if cursor:
+        after_value, after_id = decode_cursor(cursor, ranked=fts is not None)
+        after = sort_column > after_value if fts is not None else sort_column < after_value
+        query = query.filter(or_(after, and_(sort_column == after_value, ItemDB.id < after_id)))
+
+    query = query.order_by(sort_order, ItemDB.id.desc())
+    if limit:
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            last_item = last if selected else last[0] if fts is not None else last
+            sort_value = last.search_rank if fts is not None else last_item.updated_date
+            headers["X-Next-Cursor"] = encode_cursor(sort_value, last_item.id)
+    else:
+        rows = query.all()
+
+    if selected:
+        body = [{f: getattr(row, f) for f in selected} for row in rows]
+        return JSONResponse(content=jsonable_encoder(body), headers=headers)
+
+    response.headers.update(headers)
+    return [row[0] for row in rows] if fts is not None else rows
+
+def query_changes(db: Session, since: int, until: int, limit: Optional[int] = None) -> list:
+    """(version, "item" | "deleted", row) for changes in (since, until], ordered by version then id"""
+    version_col = literal_column("items.version")
+    rows = db.query(ItemDB, version_col).filter(
+        version_col > since, version_col <= until
+    ).order_by(version_col, ItemDB.id).limit(limit).all()
+    tombstones = db.execute(text(
+        "SELECT item_id, version, deleted_at FROM item_tombstones "
+        "WHERE version > :since AND version <= :until ORDER BY version, item_id LIMIT :limit"
+    ), {"since": since, "until": until, "limit": -1 if limit is None else limit}).all()
+    changes = [(version, "item", item.id, item) for item, version in rows]
+    changes += [(t.version, "deleted", t.item_id, t) for t in tombstones]
+    changes.sort(key=lambda change: (change[0], change[2]))
+    return [(version, kind, row) for version, kind, _, row in changes[:limit]]
+
+@app.get("/items/changes")
+async def get_item_changes(since: int = Query(0, ge=0), limit: int = Query(500, ge=1, le=5000),
+                           db: Session = Depends(get_db)):
+    """
+    Items written and ids deleted after inventory version since, oldest change first
+    Pass the returned version as since next time; has_more means call again straight away.
+    reset means since is older than the retained tombstones (or newer than the server):
+    drop the local copy and replace it with the items returned
+    """
+    # Bounded by the version read up front, so writes landing mid-request are left for the next call
+    current = get_version(db)[0]
+    version_col = literal_column("items.version")
+    if since < get_tombstone_floor(db) or since > current:
+        rows = db.query(ItemDB, version_col).filter(version_col <= current).order_by(version_col).all()
+        return {
+            "version": current,
+            "reset": True,
+            "has_more": False,
+            "items": [ItemResponse.model_validate(item) for item, _ in rows],
+            "deleted": [],
+        }
+
+    changes = query_changes(db, since, current, limit + 1)
+    has_more = len(changes) > limit
+    if has_more:
+        # Never end a page partway through a version, or the rest of it would be skipped next time
+        cut = changes[limit][0]
+        changes = [change for change in changes[:limit] if change[0] < cut]
+        if not changes:
+            changes = query_changes(db, cut - 1, cut)
+    return {
+        "version": changes[-1][0] if has_more else current,
+        "reset": False,
+        "has_more": has_more,
+        "items": [ItemResponse.model_validate(item) for _, kind, item in changes if kind == "item"],
+        "deleted": [{"id": t.item_id, "version": t.version, "deleted_at": t.deleted_at}
+                    for _, kind, t in changes if kind == "deleted"],
+    }
 
 @app.get("/items/expiring")
 async def get_expiring_items(days: int = 7, db: Session = Depends(get_db)):
@@ -126,11 +456,72 @@ async def get_expiring_items(days: int = 7, db: Session = Depends(get_db)):
     ).order_by(ItemDB.expiry_date).all()
     return items
 
+@app.get("/items/expiring/summary")
+async def get_expiry_summary(days: int = 7, critical_threshold: int = 3, warning_threshold: int = 7, db: Session = Depends(get_db)):
+    """
+    Bucket items into expired/critical/warning/upcoming by days until expiry
+    Uses a single indexed range scan, so cost scales with expiring items only
+    """
+    today = date.today()
+    horizon = max(days, warning_threshold)
+    rows = db.query(
+        ItemDB.id, ItemDB.name, ItemDB.brand, ItemDB.location,
+        ItemDB.category, ItemDB.quantity, ItemDB.expiry_date
+    ).filter(
+        ItemDB.expiry_date.isnot(None),
+        ItemDB.expiry_date <= today + timedelta(days=horizon)
+    ).order_by(ItemDB.expiry_date).all()
+
+    buckets = {'expired': [], 'critical': [], 'warning': [], 'upcoming': []}
+    for row in rows:
+        days_until = (row.expiry_date - today).days
+        if days_until < 0:
+            bucket = 'expired'
+        elif days_until <= critical_threshold:
+            bucket = 'critical'
+        elif days_until <= warning_threshold:
+            bucket = 'warning'
+        elif days_until <= days:
+            bucket = 'upcoming'
+        else:
+            continue
+        buckets[bucket].append({
+            'id': row.id,
+            'name': row.name,
+            'brand': row.brand,
+            'location': row.location,
+            'category': row.category or 'Uncategorized',
+            'quantity': row.quantity,
+            'expiry_date': row.expiry_date.isoformat(),
+            'days_until_expiry': days_until
+        })
+
+    return {
+        'summary': {
+            'expired': len(buckets['expired']),
+            'critical': len(buckets['critical']),
+            'warning': len(buckets['warning']),
+            'upcoming': len(buckets['upcoming']),
+            'total_expiring': len(buckets['expired']) + len(buckets['critical']) + len(buckets['warning'])
+        },
+        'items': buckets,
+        'thresholds': {
+            'critical': critical_threshold,
+            'warning': warning_threshold,
+            'days': days
+        },
+        'generated_at': datetime.now().isoformat()
+    }
+
 @app.get("/items/{item_id}", response_model=ItemResponse)
-async def get_item(item_id: int, db: Session = Depends(get_db)):
+async def get_item(item_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    not_modified, headers = check_not_modified(request, db)
+    if not_modified:
+        return not_modified
     item = db.query(ItemDB).filter(ItemDB.id == item_id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
+    response.headers.update(headers)
     return item
 
 @app.put("/items/{item_id}", response_model=ItemResponse)
@@ -144,6 +535,22 @@ async def update_item(item_id: int, item_update: ItemUpdate, db: Session = Depen
     db_item.updated_date = datetime.utcnow()
     db.commit()
     db.refresh(db_item)
+    publish_item_event(db, "item.updated", db_item.id, db_item)
+    return db_item
+
+@app.patch("/items/{item_id}/quantity", response_model=ItemResponse)
+async def adjust_quantity(item_id: int, change: QuantityChange, db: Session = Depends(get_db)):
+    """Add delta (negative to use some up) to the stored quantity in a single UPDATE; it stops at 0"""
+    db_item = db.scalars(
+        update(ItemDB).where(ItemDB.id == item_id)
+        .values(quantity=adjusted_quantity(change.delta), updated_date=datetime.utcnow())
+        .returning(ItemDB)
+    ).first()
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    db.commit()
+    db.refresh(db_item)
+    publish_item_event(db, "item.updated", db_item.id, db_item)
     return db_item
 
 @app.delete("/items/{item_id}")
@@ -153,15 +560,48 @@ async def delete_item(item_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Item not found")
     db.delete(db_item)
     db.commit()
+    publish_item_event(db, "item.deleted", item_id)
     return {"message": "Item deleted successfully", "id": item_id}
 
+@app.get("/events")
+async def get_events(request: Request, since: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events stream of item changes
+    Resumes after since (or the Last-Event-ID header a reconnecting EventSource sends)
+    """
+    current_version = get_version(db)[0]
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    # Without a starting point, stream changes from now on
+    if since is None or since > current_version:
+        since = current_version
+    db.close()
+    return StreamingResponse(
+        stream_events(since, current_version),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/events/stats")
+async def get_event_stats():
+    return event_stats()
+
 @app.get("/locations")
-async def get_locations(db: Session = Depends(get_db)):
+async def get_locations(request: Request, response: Response, db: Session = Depends(get_db)):
+    not_modified, headers = check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+    response.headers.update(headers)
     locations = db.query(ItemDB.location).distinct().all()
     return {"locations": [loc[0] for loc in locations], "count": len(locations)}
 
 @app.get("/categories")
-async def get_categories(db: Session = Depends(get_db)):
+async def get_categories(request: Request, response: Response, db: Session = Depends(get_db)):
+    not_modified, headers = check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+    response.headers.update(headers)
     categories = db.query(ItemDB.category).distinct().all()
     return {"categories": [cat[0] for cat in categories], "count": len(categories)}
 
@@ -198,17 +638,29 @@ def escape_csv_field(value):
         return f'"{value_str}"'
     return value_str
 
-def generate_csv_content(db: Session):
-    items = db.query(ItemDB).order_by(ItemDB.updated_date.desc()).all()
+CSV_HEADERS = ['Name', 'Barcode', 'Quantity', 'Location', 'Category', 'Expiry Date', 'Added Date', 'Notes']
+CSV_BATCH_SIZE = 500
 
+def iter_csv_chunks(db: Session, batch_size: int = CSV_BATCH_SIZE):
+    """
+    Yield the inventory as CSV text: the header straight away, then one chunk per batch of rows
+    Rows are fetched in batches from a streaming cursor so memory stays constant
+    """
     output = io.StringIO()
     writer = csv.writer(output)
-
-    headers = ['Name', 'Barcode', 'Quantity', 'Location', 'Category', 'Expiry Date', 'Added Date', 'Notes']
-    writer.writerow(headers)
-
-    for item in items:
-        row = [
+    writer.writerow(CSV_HEADERS)
+    # Sent before the query runs, so the download starts immediately
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate(0)
+
+    rows = db.query(
+        ItemDB.name, ItemDB.barcode, ItemDB.quantity, ItemDB.location,
+        ItemDB.category, ItemDB.expiry_date, ItemDB.added_date, ItemDB.notes
+    ).order_by(ItemDB.updated_date.desc()).execution_options(stream_results=True).yield_per(batch_size)
+
+    for count, item in enumerate(rows, start=1):
+        writer.writerow([
             item.name or '',
             item.barcode or '',
             item.quantity or 1,
@@ -217,19 +669,32 @@ def generate_csv_content(db: Session):
             item.expiry_date.isoformat() if item.expiry_date else '',
             item.added_date.isoformat() if item.added_date else '',
             item.notes or '',
-        ]
-        writer.writerow(row)
+        ])
+        if count % batch_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
 
-    return output.getvalue()
+    if output.tell():
+        yield output.getvalue()
 
-@app.get("/export/csv")
-async def export_csv(db: Session = Depends(get_db)):
-    csv_content = generate_csv_content(db)
+def generate_csv_content(db: Session):
+    return ''.join(iter_csv_chunks(db))
+
+def stream_csv_export():
+    """CSV chunk generator that owns its session, which must outlive the request handler"""
+    db = SessionLocal()
+    try:
+        yield from iter_csv_chunks(db)
+    finally:
+        db.close()
 
+@app.get("/export/csv")
+async def export_csv():
     filename = f"pantrypal_export_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.csv"
 
     return StreamingResponse(
-        io.StringIO(csv_content),
+        stream_csv_export(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -274,7 +739,33 @@ def cleanup_old_backups():
     except Exception as e:
         logger.error(f"Backup cleanup failed: {str(e)}")
 
+def save_snapshot_backup():
+    try:
+        entry = backup.run_snapshot_backup(
+            engine, ItemDB.__table__, BACKUP_PATH,
+            compression=BACKUP_COMPRESSION, full_every=BACKUP_FULL_EVERY
+        )
+        logger.info(f"Backup saved successfully: {entry['file']} ({entry['type']})")
+
+        for filename in backup.prune_backups(BACKUP_PATH, BACKUP_RETENTION_DAYS):
+            logger.info(f"Deleted old backup: {filename}")
+
+    except Exception as e:
+        logger.error(f"Backup failed: {str(e)}")
+
+def use_snapshot_backups() -> bool:
+    if BACKUP_MODE != "snapshot":
+        return False
+    if engine.dialect.name != "sqlite":
+        logger.warning("BACKUP_MODE=snapshot requires SQLite, falling back to CSV backups")
+        return False
+    return True
+
 def scheduled_backup():
+    if use_snapshot_backups():
+        save_snapshot_backup()
+        return
+
     db = SessionLocal()
     try:
         save_backup(db)
@@ -283,23 +774,39 @@ def scheduled_backup():
 
 @app.on_event("startup")
 async def startup_event():
+    db = SessionLocal()
+    try:
+        init_event_feed(get_version(db)[0])
+    finally:
+        db.close()
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        compact_tombstones,
+        args=[engine],
+        trigger=CronTrigger.from_crontab(TOMBSTONE_COMPACT_SCHEDULE),
+        id='tombstone_compaction_job',
+        name='Tombstone Compaction',
+        replace_existing=True
+    )
+
     if BACKUP_ENABLED:
         logger.info(f"Backup enabled with schedule: {BACKUP_SCHEDULE}")
+        logger.info(f"Backup mode: {BACKUP_MODE}")
         logger.info(f"Backup retention: {BACKUP_RETENTION_DAYS} days")
         logger.info(f"Backup path: {BACKUP_PATH}")
 
-        scheduler = BackgroundScheduler()
         scheduler.add_job(
             scheduled_backup,
             trigger=CronTrigger.from_crontab(BACKUP_SCHEDULE),
             id='backup_job',
-            name='Automated CSV Backup',
+            name='Automated Backup',
             replace_existing=True
         )
-        scheduler.start()
-        logger.info("Backup scheduler started")
+        logger.info("Backup job scheduled")
     else:
         logger.info("Backup disabled")
+    scheduler.start()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,129 @@
+import logging
+import re
+from typing import Optional
+from sqlalchemy import text, Integer, Float
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Columns indexed for search, with their bm25 weights (name matches rank highest)
+FTS_COLUMNS = ["name", "brand", "barcode", "notes", "category"]
+FTS_WEIGHTS = [10.0, 5.0, 5.0, 1.0, 2.0]
+
+# Tokenizer of the items_fts table, or None when FTS5 isn't available
+fts_tokenizer: Optional[str] = None
+
+
+def _create_fts_table(conn) -> Optional[str]:
+    """Create items_fts with the best available tokenizer, returns its name"""
+    columns = ", ".join(FTS_COLUMNS)
+    candidates = [
+        # Substring matching like the old ILIKE search (SQLite >= 3.34)
+        ("trigram", "tokenize='trigram'"),
+        # Word/prefix matching on older SQLite builds
+        ("unicode61", "tokenize='unicode61', prefix='2 3'"),
+    ]
+    for tokenizer, options in candidates:
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE items_fts USING fts5({columns}, "
+                f"content='items', content_rowid='id', {options})"
+            ))
+            return tokenizer
+        except OperationalError:
+            continue
+    return None
+
+
+def _create_sync_triggers(conn):
+    """Keep items_fts in sync with items on insert/update/delete"""
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF {columns} ON items BEGIN
+            INSERT INTO items_fts(items_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO items_fts(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """))
+
+
+def init_search_index(engine) -> Optional[str]:
+    """
+    Set up the FTS5 search index on SQLite databases
+    Existing items are indexed the first time the table is created
+    """
+    global fts_tokenizer
+
+    if engine.dialect.name != "sqlite":
+        logger.info("Full-text search disabled: not a SQLite database")
+        return None
+
+    with engine.begin() as conn:
+        existing = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'"
+        )).scalar()
+
+        if existing:
+            tokenizer = "trigram" if "trigram" in existing else "unicode61"
+        else:
+            tokenizer = _create_fts_table(conn)
+            if tokenizer is None:
+                logger.warning("Full-text search disabled: SQLite was built without FTS5")
+                return None
+            conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+        _create_sync_triggers(conn)
+
+    fts_tokenizer = tokenizer
+    logger.info(f"Full-text search enabled ({tokenizer} tokenizer)")
+    return tokenizer
+
+
+def build_match_query(search: str) -> Optional[str]:
+    """
+    Turn user input into an FTS5 MATCH expression (all terms must match)
+    Returns None when the index can't answer the query and callers should fall back
+    """
+    if fts_tokenizer is None:
+        return None
+
+    terms = [t for t in re.split(r"\s+", search.strip()) if t]
+    if not terms:
+        return None
+
+    # Trigram indexes can't match terms shorter than three characters
+    if fts_tokenizer == "trigram" and any(len(t) < 3 for t in terms):
+        return None
+
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    if fts_tokenizer != "trigram":
+        quoted = [q + "*" for q in quoted]
+    return " ".join(quoted)
+
+
+def search_subquery(search: str):
+    """
+    Subquery of (item_id, search_rank) for items matching search, or None
+    Lower search_rank is a better match
+    """
+    match = build_match_query(search)
+    if match is None:
+        return None
+
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    return text(
+        f"SELECT rowid AS item_id, bm25(items_fts, {weights}) AS search_rank "
+        f"FROM items_fts WHERE items_fts MATCH :match"
+    ).bindparams(match=match).columns(item_id=Integer, search_rank=Float).subquery("fts")
@@ -0,0 +1,174 @@
+"""
+SQLite connection tuning for the inventory engine
+
+Every new pooled connection gets the pragmas below through a connect event:
+WAL so readers and the writer don't block each other, synchronous=NORMAL
+(durable across application crashes, and WAL keeps the file consistent even
+across power loss), a memory-mapped read path, a larger page cache and a
+busy timeout so a briefly locked database waits instead of raising
+"database is locked". Set SQLITE_TUNING=false to run with SQLite's defaults.
+WAL needs a local filesystem; keep the database off network shares.
+
+    python -m app.sqlite_tuning --benchmark
+"""
+import logging
+import os
+from typing import Dict, Optional
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "true").lower() == "true"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def tuned_pragmas() -> Dict[str, str]:
+    """Pragmas applied to each connection, in order"""
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "mmap_size": str(SQLITE_MMAP_SIZE),
+        # Negative values are KiB rather than pages
+        "cache_size": str(-SQLITE_CACHE_SIZE_KB),
+        "busy_timeout": str(SQLITE_BUSY_TIMEOUT_MS),
+    }
+
+
+def apply_tuning(engine, pragmas: Optional[Dict[str, str]] = None):
+    """Register a connect event that sets the pragmas on every new connection of a SQLite engine"""
+    if engine.dialect.name != "sqlite":
+        return
+    if pragmas is None:
+        if not SQLITE_TUNING:
+            logger.info("SQLite tuning disabled, using SQLite defaults")
+            return
+        pragmas = tuned_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    logger.info("SQLite tuning: " + ", ".join(f"{name}={value}" for name, value in pragmas.items()))
+
+
+# ----------------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------------
+
+def _run_benchmark(db_path: str, pragmas: Optional[Dict[str, str]], seconds: float,
+                   readers: int, writers: int, rows: int) -> Dict:
+    """Concurrent readers and writers against a scratch items-like table, returns ops per second"""
+    import random
+    import threading
+    import time
+    from datetime import datetime
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False},
+                           pool_size=readers + writers)
+    if pragmas:
+        apply_tuning(engine, pragmas)
+    locations = ["Fridge", "Freezer", "Pantry", "Basement Pantry"]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE items (
+                id INTEGER PRIMARY KEY, name TEXT NOT NULL, location TEXT,
+                quantity INTEGER, updated_date TIMESTAMP
+            )
+        """))
+        conn.execute(text("CREATE INDEX ix_items_location ON items (location)"))
+        conn.execute(
+            text("INSERT INTO items (name, location, quantity, updated_date) VALUES (:name, :location, 1, :now)"),
+            [{"name": f"Item {i}", "location": random.choice(locations), "now": datetime.utcnow()}
+             for i in range(rows)]
+        )
+
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader():
+        done = 0
+        with engine.connect() as conn:
+            while time.perf_counter() < deadline:
+                try:
+                    conn.execute(text("SELECT * FROM items WHERE location = :location ORDER BY id LIMIT 50"),
+                                 {"location": random.choice(locations)}).all()
+                    conn.commit()
+                    done += 1
+                except OperationalError:
+                    conn.rollback()
+                    with lock:
+                        counts["locked"] += 1
+        with lock:
+            counts["reads"] += done
+
+    def writer():
+        done = 0
+        while time.perf_counter() < deadline:
+            try:
+                # One commit per request, like the API endpoints
+                with engine.begin() as conn:
+                    conn.execute(text("UPDATE items SET quantity = quantity + 1, updated_date = :now WHERE id = :id"),
+                                 {"now": datetime.utcnow(), "id": random.randint(1, rows)})
+                done += 1
+            except OperationalError:
+                with lock:
+                    counts["locked"] += 1
+        with lock:
+            counts["writes"] += done
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "reads_per_second": round(counts["reads"] / seconds),
+        "writes_per_second": round(counts["writes"] / seconds),
+        "locked_errors": counts["locked"],
+    }
+
+
+def benchmark(seconds: float = 5.0, readers: int = 4, writers: int = 2, rows: int = 5000) -> Dict[str, Dict]:
+    """Same workload with SQLite's defaults and with the tuned pragmas, each on a fresh file"""
+    import tempfile
+
+    results = {}
+    for profile, pragmas in (("default", None), ("tuned", tuned_pragmas())):
+        with tempfile.TemporaryDirectory() as tmp:
+            results[profile] = _run_benchmark(os.path.join(tmp, "bench.db"), pragmas, seconds, readers, writers, rows)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PantryPal inventory SQLite tuning")
+    parser.add_argument("--benchmark", action="store_true", help="Compare default and tuned settings")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g}s per profile, {args.rows} rows")
+        for profile, result in benchmark(args.seconds, args.readers, args.writers, args.rows).items():
+            print(f"{profile:>8}: {result['reads_per_second']:>7} reads/s  {result['writes_per_second']:>6} writes/s  "
+                  f"{result['locked_errors']} 'database is locked' errors")
+    else:
+        print("\n".join(f"PRAGMA {name}={value}" for name, value in tuned_pragmas().items()))
@@ -0,0 +1,162 @@
+"""
+Inventory version for conditional GETs and delta sync
+
+A single-row inventory_version table is bumped by triggers on every insert,
+update and delete of items, whichever code path makes the change. Read
+endpoints derive ETag/Last-Modified from it and answer 304 before running
+their query when the client's copy is still current.
+
+The same triggers stamp each item row with the version of its last write
+and record deletions in item_tombstones, so "what changed since version N"
+is an indexed range scan. Tombstones older than TOMBSTONE_RETENTION_DAYS are
+compacted away; tombstone_floor remembers the newest one dropped, and
+clients asking for changes from before it have to resync from scratch.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from fastapi import Request, Response
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+
+_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now')"
+_BUMP = f"UPDATE inventory_version SET version = version + 1, updated_at = {_NOW} WHERE id = 1;"
+_CURRENT = "(SELECT version FROM inventory_version WHERE id = 1)"
+
+_TRIGGERS = {
+    "items_version_ai": f"""
+        AFTER INSERT ON items BEGIN
+            {_BUMP}
+            UPDATE items SET version = {_CURRENT} WHERE id = NEW.id;
+            DELETE FROM item_tombstones WHERE item_id = NEW.id;
+        END
+    """,
+    # Skips the row stamp made by the insert trigger; recursive_triggers is off, so its own stamp doesn't refire it
+    "items_version_au": f"""
+        AFTER UPDATE ON items WHEN NEW.version IS OLD.version BEGIN
+            {_BUMP}
+            UPDATE items SET version = {_CURRENT} WHERE id = NEW.id;
+        END
+    """,
+    "items_version_ad": f"""
+        AFTER DELETE ON items BEGIN
+            {_BUMP}
+            INSERT OR REPLACE INTO item_tombstones (item_id, version, deleted_at) VALUES (OLD.id, {_CURRENT}, {_NOW});
+        END
+    """,
+}
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def init_version_tracking(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS inventory_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                updated_at TEXT NOT NULL,
+                tombstone_floor INTEGER NOT NULL DEFAULT 0
+            )
+        """))
+        conn.execute(text(f"INSERT OR IGNORE INTO inventory_version (id, version, updated_at) VALUES (1, 0, {_NOW})"))
+        if "tombstone_floor" not in _columns(conn, "inventory_version"):
+            conn.execute(text("ALTER TABLE inventory_version ADD COLUMN tombstone_floor INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS item_tombstones (
+                item_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                deleted_at TEXT NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_item_tombstones_version ON item_tombstones (version)"))
+
+        # Recreated on every start so databases from older releases pick up the current definitions
+        for name in _TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        if "version" not in _columns(conn, "items"):
+            conn.execute(text("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        # Rows from before row versions existed get distinct versions above the current one, so
+        # a sync from 0 includes them and every version still belongs to a single change
+        unversioned = conn.execute(text("SELECT MAX(id) FROM items WHERE version = 0")).scalar()
+        if unversioned is not None:
+            conn.execute(text(f"UPDATE items SET version = {_CURRENT} + id WHERE version = 0"))
+            conn.execute(text(f"UPDATE inventory_version SET version = version + :top, updated_at = {_NOW} WHERE id = 1"),
+                         {"top": unversioned})
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_items_version ON items (version)"))
+        for name, body in _TRIGGERS.items():
+            conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+
+
+def get_version(db) -> Tuple[int, datetime]:
+    version, updated_at = db.execute(text("SELECT version, updated_at FROM inventory_version WHERE id = 1")).one()
+    return version, datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc)
+
+
+def get_tombstone_floor(db) -> int:
+    return db.execute(text("SELECT tombstone_floor FROM inventory_version WHERE id = 1")).scalar()
+
+
+def compact_tombstones(engine, retention_days: int = TOMBSTONE_RETENTION_DAYS) -> int:
+    """Drop tombstones older than retention_days and raise the floor past them, returns the number dropped"""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).isoformat()
+    with engine.begin() as conn:
+        newest = conn.execute(text("SELECT MAX(version) FROM item_tombstones WHERE deleted_at < :cutoff"),
+                              {"cutoff": cutoff}).scalar()
+        if newest is None:
+            return 0
+        conn.execute(text("UPDATE inventory_version SET tombstone_floor = MAX(tombstone_floor, :floor) WHERE id = 1"),
+                     {"floor": newest})
+        # By version rather than date, so everything at or below the floor goes together
+        dropped = conn.execute(text("DELETE FROM item_tombstones WHERE version <= :floor"), {"floor": newest}).rowcount
+    logger.info(f"Compacted {dropped} item tombstones (sync floor is now version {newest})")
+    return dropped
+
+
+def cache_headers(version: int, updated_at: datetime) -> Dict[str, str]:
+    # Weak: the gateway may rewrite parts of the body (e.g. image URLs)
+    return {
+        "ETag": f'W/"{version}"',
+        "Last-Modified": format_datetime(updated_at.replace(microsecond=0), usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
+def _etag_matches(if_none_match: str, version: int) -> bool:
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == f'"{version}"':
+            return True
+    return False
+
+
+def check_not_modified(request: Request, db) -> Tuple[Optional[Response], Dict[str, str]]:
+    """
+    Returns (304 response or None, validator headers to send with the full response)
+    If-None-Match wins over If-Modified-Since, as in RFC 9110
+    """
+    version, updated_at = get_version(db)
+    headers = cache_headers(version, updated_at)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, version)
+    else:
+        not_modified = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                not_modified = updated_at.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                pass
+
+    if not_modified:
+        return Response(status_code=304, headers=headers), headers
+    return None, headers
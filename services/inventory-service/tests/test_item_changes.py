@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/inventory.db")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.main import app, get_db
+from app.search import init_search_index
+from app.versioning import init_version_tracking
+
+# items as created by releases before row versions and the inventory_version table
+BASELINE_SCHEMA = """
+    CREATE TABLE items (
+        id INTEGER NOT NULL PRIMARY KEY,
+        barcode VARCHAR, name VARCHAR NOT NULL, brand VARCHAR, image_url VARCHAR,
+        category VARCHAR, location VARCHAR, quantity INTEGER, expiry_date DATE,
+        notes VARCHAR, manually_added BOOLEAN, added_date DATETIME, updated_date DATETIME
+    )
+"""
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A pre-upgrade database holding 5 items, migrated the way the service does on startup"""
+    path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO items (name, category, location, quantity, manually_added, added_date, updated_date) "
+        "VALUES (?, 'Uncategorized', 'Pantry', 1, 0, '2024-01-01 00:00:00', '2024-01-01 00:00:00')",
+        [(f"Item {i}",) for i in range(1, 6)]
+    )
+    conn.commit()
+    conn.close()
+
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    init_search_index(engine)
+    init_version_tracking(engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    yield path
+    app.dependency_overrides.pop(get_db, None)
+    engine.dispose()
+
+
+def set_versions(path, versions):
+    """Give items 1..n the given row versions (ties included) and move the counter past them"""
+    conn = sqlite3.connect(path)
+    # Via a value no row has, since an update that leaves version unchanged is restamped by the trigger
+    conn.execute("UPDATE items SET version = -id")
+    for item_id, version in enumerate(versions, start=1):
+        conn.execute("UPDATE items SET version = ? WHERE id = ?", (version, item_id))
+    conn.execute("UPDATE inventory_version SET version = ?", (max(versions),))
+    conn.commit()
+    conn.close()
+
+
+def sync_all(client, since=0, limit=500):
+    """Follow has_more from since, returning the item ids seen and the final version"""
+    seen = []
+    for _ in range(20):
+        body = client.get("/items/changes", params={"since": since, "limit": limit}).json()
+        seen += [item["id"] for item in body["items"]]
+        since = body["version"]
+        if not body["has_more"]:
+            return seen, since
+    pytest.fail("paging did not finish")
+
+
+def test_upgraded_rows_are_included_in_first_sync(baseline_db):
+    client = TestClient(app)
+    body = client.get("/items/changes", params={"since": 0}).json()
+
+    assert body["reset"] is False
+    assert sorted(item["id"] for item in body["items"]) == [1, 2, 3, 4, 5]
+    assert body["version"] >= 5
+
+    conn = sqlite3.connect(baseline_db)
+    versions = [row[0] for row in conn.execute("SELECT version FROM items")]
+    conn.close()
+    assert 0 not in versions
+    assert len(set(versions)) == len(versions)
+
+
+def test_changes_after_upgrade_continue_from_returned_version(baseline_db):
+    client = TestClient(app)
+    version = client.get("/items/changes", params={"since": 0}).json()["version"]
+    client.put("/items/3", json={"quantity": 4})
+
+    body = client.get("/items/changes", params={"since": version}).json()
+    assert [item["id"] for item in body["items"]] == [3]
+
+
+@pytest.mark.parametrize("versions", [[7, 7, 7, 7, 7], [1, 2, 2, 2, 3], [1, 1, 2, 3, 3]])
+def test_paging_never_splits_a_shared_version(baseline_db, versions):
+    set_versions(baseline_db, versions)
+    client = TestClient(app)
+
+    seen, version = sync_all(client, limit=2)
+
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+    assert version == max(versions)
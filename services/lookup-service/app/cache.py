@@ -0,0 +1,389 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "/app/data/lookup_cache.db")
+CACHE_TTL_DAYS = int(os.getenv("CACHE_TTL_DAYS", "30"))
+# Barcodes no provider knows are remembered for a shorter time
+NEGATIVE_CACHE_TTL_HOURS = int(os.getenv("NEGATIVE_CACHE_TTL_HOURS", "24"))
+
+# In-memory tier in front of the SQLite table
+MEMORY_CACHE_SIZE = int(os.getenv("LOOKUP_MEMORY_CACHE_SIZE", "5000"))
+MEMORY_CACHE_TTL_SECONDS = int(os.getenv("LOOKUP_MEMORY_CACHE_TTL", "3600"))
+
+# Maintenance: entries beyond CACHE_MAX_ENTRIES (0 = unlimited) are evicted least recently hit first
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+PRUNE_BATCH_SIZE = int(os.getenv("CACHE_PRUNE_BATCH_SIZE", "1000"))
+
+# Hot entries: barcode -> (product_data, memory_expires_at), least recently used first
+_memory: "OrderedDict[str, tuple]" = OrderedDict()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+_negative_stats = {"hits": 0}
+# Hits not yet written to hit_count/last_hit_at, flushed in batches by flush_hit_counts()
+_pending_hits: Dict[str, int] = {}
+_last_prune: Optional[Dict] = None
+
+# One long-lived connection for the disk tier, shared under a lock
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Persistent WAL-mode connection to the cache database"""
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+    return _conn
+
+
+def close_connection():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def init_cache_db():
+    with _lock:
+        conn = get_connection()
+        # Let prune_cache() hand freed pages back to the OS; existing files need one VACUUM to switch
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lookup_cache (
+                barcode TEXT PRIMARY KEY,
+                product_data TEXT NOT NULL,
+                cached_at TIMESTAMP NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                last_hit_at TIMESTAMP
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(lookup_cache)")}
+        if "hit_count" not in columns:
+            conn.execute("ALTER TABLE lookup_cache ADD COLUMN hit_count INTEGER NOT NULL DEFAULT 0")
+        if "last_hit_at" not in columns:
+            conn.execute("ALTER TABLE lookup_cache ADD COLUMN last_hit_at TIMESTAMP")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lookup_negative_cache (
+                barcode TEXT PRIMARY KEY,
+                cached_at TIMESTAMP NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_lookup_cache_expires_at ON lookup_cache (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_lookup_cache_recency "
+                     "ON lookup_cache (COALESCE(last_hit_at, cached_at))")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_lookup_negative_cache_expires_at "
+                     "ON lookup_negative_cache (expires_at)")
+        conn.commit()
+
+
+# ----------------------------------------------------------------------------
+# Memory tier
+# ----------------------------------------------------------------------------
+
+def _memory_get(barcode: str) -> Optional[dict]:
+    entry = _memory.get(barcode)
+    if entry is None:
+        return None
+    product_data, expires_at = entry
+    if datetime.utcnow() >= expires_at:
+        del _memory[barcode]
+        return None
+    _memory.move_to_end(barcode)
+    return product_data
+
+
+def _memory_put(barcode: str, product_data: dict, disk_expires_at: datetime):
+    # Never keep an entry in memory past its CACHE_TTL_DAYS expiry on disk
+    expires_at = min(disk_expires_at, datetime.utcnow() + timedelta(seconds=MEMORY_CACHE_TTL_SECONDS))
+    _memory[barcode] = (product_data, expires_at)
+    _memory.move_to_end(barcode)
+    while len(_memory) > MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+# ----------------------------------------------------------------------------
+# Public API
+# ----------------------------------------------------------------------------
+
+def get_from_cache(barcode: str) -> Optional[dict]:
+    return get_many_from_cache([barcode]).get(barcode)
+
+
+def get_many_from_cache(barcodes: List[str]) -> Dict[str, dict]:
+    """
+    Fetch cached entries for several barcodes
+    Memory hits are served directly; the rest are read with a single query
+    """
+    results = {}
+    with _lock:
+        disk_lookups = []
+        for barcode in barcodes:
+            product_data = _memory_get(barcode)
+            if product_data is not None:
+                _stats["memory_hits"] += 1
+                _pending_hits[barcode] = _pending_hits.get(barcode, 0) + 1
+                results[barcode] = dict(product_data)
+            else:
+                disk_lookups.append(barcode)
+
+        if disk_lookups:
+            placeholders = ",".join("?" for _ in disk_lookups)
+            cursor = get_connection().execute(
+                f"SELECT barcode, product_data, expires_at FROM lookup_cache "
+                f"WHERE barcode IN ({placeholders}) AND expires_at > ?",
+                (*disk_lookups, datetime.utcnow().isoformat())
+            )
+            rows = cursor.fetchall()
+            for barcode, product_data, expires_at in rows:
+                product_data = json.loads(product_data)
+                _memory_put(barcode, product_data, datetime.fromisoformat(expires_at))
+                _pending_hits[barcode] = _pending_hits.get(barcode, 0) + 1
+                results[barcode] = dict(product_data)
+            _stats["disk_hits"] += len(rows)
+            _stats["misses"] += len(disk_lookups) - len(rows)
+    return results
+
+
+def save_to_cache(barcode: str, product_data: dict):
+    save_many_to_cache({barcode: product_data})
+
+
+def save_many_to_cache(products: Dict[str, dict]):
+    """Cache several lookups in one transaction, keeping the hit counts of refreshed entries"""
+    if not products:
+        return
+    cached_at = datetime.utcnow()
+    expires_at = cached_at + timedelta(days=CACHE_TTL_DAYS)
+    with _lock:
+        conn = get_connection()
+        conn.executemany(
+            "INSERT INTO lookup_cache (barcode, product_data, cached_at, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(barcode) DO UPDATE SET product_data = excluded.product_data, "
+            "cached_at = excluded.cached_at, expires_at = excluded.expires_at",
+            [(barcode, json.dumps(product_data), cached_at.isoformat(), expires_at.isoformat())
+             for barcode, product_data in products.items()]
+        )
+        conn.executemany("DELETE FROM lookup_negative_cache WHERE barcode = ?",
+                         [(barcode,) for barcode in products])
+        conn.commit()
+        for barcode, product_data in products.items():
+            _memory_put(barcode, dict(product_data), expires_at)
+
+
+def delete_from_cache(barcode: str) -> int:
+    with _lock:
+        _memory.pop(barcode, None)
+        conn = get_connection()
+        deleted = conn.execute("DELETE FROM lookup_cache WHERE barcode = ?", (barcode,)).rowcount
+        deleted += conn.execute("DELETE FROM lookup_negative_cache WHERE barcode = ?", (barcode,)).rowcount
+        conn.commit()
+    return deleted
+
+
+def clear_cache() -> int:
+    with _lock:
+        _memory.clear()
+        conn = get_connection()
+        deleted = conn.execute("DELETE FROM lookup_cache").rowcount
+        deleted += conn.execute("DELETE FROM lookup_negative_cache").rowcount
+        conn.commit()
+    return deleted
+
+
+def flush_hit_counts() -> int:
+    """Write the hits counted since the last flush in one transaction"""
+    with _lock:
+        if not _pending_hits:
+            return 0
+        hits = list(_pending_hits.items())
+        _pending_hits.clear()
+        now = datetime.utcnow().isoformat()
+        conn = get_connection()
+        conn.executemany(
+            "UPDATE lookup_cache SET hit_count = hit_count + ?, last_hit_at = ? WHERE barcode = ?",
+            [(count, now, barcode) for barcode, count in hits]
+        )
+        conn.commit()
+    return len(hits)
+
+
+def get_refresh_candidates(within_seconds: int, limit: int) -> List[str]:
+    """Barcodes expiring within the window (or already expired), most hit first"""
+    cutoff = (datetime.utcnow() + timedelta(seconds=within_seconds)).isoformat()
+    with _lock:
+        rows = get_connection().execute(
+            "SELECT barcode FROM lookup_cache WHERE expires_at < ? ORDER BY hit_count DESC, expires_at LIMIT ?",
+            (cutoff, limit)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def uncached_barcodes(barcodes: List[str]) -> List[str]:
+    """Barcodes with neither a valid entry nor a negative entry, without counting hits"""
+    if not barcodes:
+        return []
+    now = datetime.utcnow().isoformat()
+    known = set()
+    with _lock:
+        conn = get_connection()
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(barcodes), 500):
+            chunk = barcodes[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            for table in ("lookup_cache", "lookup_negative_cache"):
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT barcode FROM {table} WHERE barcode IN ({placeholders}) AND expires_at > ?",
+                    (*chunk, now)
+                ))
+    return [barcode for barcode in barcodes if barcode not in known]
+
+
+def get_negative_cached(barcodes: List[str]) -> List[str]:
+    """Barcodes among these that are known not to exist at any provider"""
+    if not barcodes:
+        return []
+    with _lock:
+        placeholders = ",".join("?" for _ in barcodes)
+        rows = get_connection().execute(
+            f"SELECT barcode FROM lookup_negative_cache WHERE barcode IN ({placeholders}) AND expires_at > ?",
+            (*barcodes, datetime.utcnow().isoformat())
+        ).fetchall()
+        _negative_stats["hits"] += len(rows)
+    return [row[0] for row in rows]
+
+
+def save_negative(barcodes: List[str]):
+    """Remember barcodes that every provider answered 'not found' for"""
+    if not barcodes:
+        return
+    cached_at = datetime.utcnow()
+    expires_at = cached_at + timedelta(hours=NEGATIVE_CACHE_TTL_HOURS)
+    with _lock:
+        conn = get_connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO lookup_negative_cache (barcode, cached_at, expires_at) VALUES (?, ?, ?)",
+            [(barcode, cached_at.isoformat(), expires_at.isoformat()) for barcode in barcodes]
+        )
+        conn.commit()
+
+
+def purge_negative() -> int:
+    with _lock:
+        conn = get_connection()
+        deleted = conn.execute("DELETE FROM lookup_negative_cache").rowcount
+        conn.commit()
+    return deleted
+
+
+def _delete_in_batches(select_sql: str, params: tuple, table: str, batch_size: int,
+                       limit: Optional[int] = None) -> int:
+    """
+    Delete the rows select_sql returns (at most limit), batch_size at a time
+    The lock is released between batches so lookups aren't blocked for the whole prune
+    """
+    deleted = 0
+    while limit is None or deleted < limit:
+        size = batch_size if limit is None else min(batch_size, limit - deleted)
+        with _lock:
+            conn = get_connection()
+            barcodes = [row[0] for row in conn.execute(f"{select_sql} LIMIT ?", (*params, size))]
+            if not barcodes:
+                return deleted
+            placeholders = ",".join("?" for _ in barcodes)
+            conn.execute(f"DELETE FROM {table} WHERE barcode IN ({placeholders})", barcodes)
+            conn.commit()
+            for barcode in barcodes:
+                _memory.pop(barcode, None)
+        deleted += len(barcodes)
+        if len(barcodes) < size:
+            return deleted
+    return deleted
+
+
+def prune_cache(max_entries: int = CACHE_MAX_ENTRIES, batch_size: int = PRUNE_BATCH_SIZE) -> Dict:
+    """
+    Delete expired entries, evict the least recently hit entries above
+    max_entries, then release the freed pages with an incremental vacuum
+    """
+    global _last_prune
+    flush_hit_counts()
+    now = datetime.utcnow().isoformat()
+
+    expired = _delete_in_batches(
+        "SELECT barcode FROM lookup_cache WHERE expires_at <= ?", (now,), "lookup_cache", batch_size
+    )
+    negative_expired = _delete_in_batches(
+        "SELECT barcode FROM lookup_negative_cache WHERE expires_at <= ?", (now,),
+        "lookup_negative_cache", batch_size
+    )
+
+    evicted = 0
+    if max_entries > 0:
+        with _lock:
+            excess = get_connection().execute("SELECT COUNT(*) FROM lookup_cache").fetchone()[0] - max_entries
+        if excess > 0:
+            evicted = _delete_in_batches(
+                "SELECT barcode FROM lookup_cache ORDER BY COALESCE(last_hit_at, cached_at)", (),
+                "lookup_cache", batch_size, limit=excess
+            )
+
+    with _lock:
+        conn = get_connection()
+        conn.commit()
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() steps the pragma once (one page); executescript runs it to completion
+        conn.executescript("PRAGMA incremental_vacuum;")
+        pages_freed = free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    _last_prune = {
+        "at": datetime.utcnow().isoformat(),
+        "expired_deleted": expired,
+        "negative_expired_deleted": negative_expired,
+        "evicted": evicted,
+        "pages_freed": pages_freed
+    }
+    return _last_prune
+
+
+def cache_stats() -> Dict:
+    with _lock:
+        conn = get_connection()
+        total = conn.execute("SELECT COUNT(*) FROM lookup_cache").fetchone()[0]
+        valid = conn.execute("SELECT COUNT(*) FROM lookup_cache WHERE expires_at > ?",
+                             (datetime.utcnow().isoformat(),)).fetchone()[0]
+        negative_total = conn.execute("SELECT COUNT(*) FROM lookup_negative_cache").fetchone()[0]
+        negative_valid = conn.execute("SELECT COUNT(*) FROM lookup_negative_cache WHERE expires_at > ?",
+                                      (datetime.utcnow().isoformat(),)).fetchone()[0]
+        return {
+            "total_cached": total,
+            "valid_cached": valid,
+            "expired": total - valid,
+            "ttl_days": CACHE_TTL_DAYS,
+            "max_entries": CACHE_MAX_ENTRIES,
+            "last_prune": _last_prune,
+            "memory": {
+                "size": len(_memory),
+                "max_size": MEMORY_CACHE_SIZE,
+                "ttl_seconds": MEMORY_CACHE_TTL_SECONDS,
+                **_stats
+            },
+            "negative": {
+                "total_cached": negative_total,
+                "valid_cached": negative_valid,
+                "ttl_hours": NEGATIVE_CACHE_TTL_HOURS,
+                **_negative_stats
+            }
+        }
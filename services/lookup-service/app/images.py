@@ -0,0 +1,185 @@
+"""
+Product image proxy and thumbnail cache
+
+Remote image URLs are registered under an id derived from the URL. Only
+registered URLs are ever fetched, so the endpoint can't be used as an
+open proxy. Each original is downloaded once and stored by the SHA-256
+of its content. Resized thumbnails are stored next to it under the same
+hash, so identical images reached through different URLs share one set
+of files, and the hash doubles as the ETag.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/app/data/image_cache")
+# Thumbnail widths that may be requested; other widths snap to the next size up
+IMAGE_WIDTHS = sorted(int(w) for w in os.getenv("IMAGE_WIDTHS", "96,256,512").split(",") if w.strip())
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+try:
+    from PIL import Image
+    RESIZE_AVAILABLE = True
+except ImportError:
+    Image = None
+    RESIZE_AVAILABLE = False
+    print("Pillow is not installed, images are proxied without resizing")
+
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# One download per image at a time
+_fetch_locks: Dict[str, asyncio.Lock] = {}
+
+
+class ImageNotFound(Exception):
+    pass
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+def image_id(url: str) -> str:
+    """Stable id for a remote image URL (the gateway computes the same value)"""
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def valid_image_id(source_id: str) -> bool:
+    """Ids are always image_id() output; anything else never reaches a filesystem path"""
+    return bool(IMAGE_ID_PATTERN.match(source_id))
+
+
+def _source_path(source_id: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, "sources", source_id[:2], f"{source_id}.json")
+
+
+def _blob_path(content_hash: str, suffix: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, "blobs", content_hash[:2], f"{content_hash}{suffix}")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _load_source(source_id: str) -> Optional[Dict]:
+    try:
+        with open(_source_path(source_id), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def register_urls(urls: List[str]) -> Dict[str, str]:
+    """Allow these http(s) URLs to be proxied, returns {url: image id}"""
+    registered = {}
+    for url in urls:
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            continue
+        source_id = image_id(url)
+        if not os.path.exists(_source_path(source_id)):
+            _write_atomic(_source_path(source_id), json.dumps({"url": url}).encode("utf-8"))
+        registered[url] = source_id
+    return registered
+
+
+async def _fetch_original(source_id: str, source: Dict) -> Dict:
+    """Download the original once and record its content hash in the source file"""
+    lock = _fetch_locks.setdefault(source_id, asyncio.Lock())
+    try:
+        async with lock:
+            current = _load_source(source_id) or source
+            if current.get("sha256"):
+                return current
+            try:
+                async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as client:
+                    async with client.stream("GET", current["url"]) as response:
+                        if response.status_code != 200:
+                            raise ImageFetchError(f"Image source returned {response.status_code}")
+                        content_type = response.headers.get("content-type", "").split(";")[0].strip()
+                        if not content_type.startswith("image/"):
+                            raise ImageFetchError(f"Not an image: {content_type or 'unknown type'}")
+                        chunks, size = [], 0
+                        async for chunk in response.aiter_bytes():
+                            size += len(chunk)
+                            if size > IMAGE_MAX_BYTES:
+                                raise ImageFetchError("Image too large")
+                            chunks.append(chunk)
+            except httpx.HTTPError as e:
+                raise ImageFetchError(f"Image fetch error: {e}")
+
+            content = b"".join(chunks)
+            content_hash = hashlib.sha256(content).hexdigest()
+            original_path = _blob_path(content_hash, "")
+            if not os.path.exists(original_path):
+                _write_atomic(original_path, content)
+            current.update({"sha256": content_hash, "content_type": content_type})
+            _write_atomic(_source_path(source_id), json.dumps(current).encode("utf-8"))
+            return current
+    finally:
+        # Only once the source file records the hash, so late arrivals never fetch again
+        if _fetch_locks.get(source_id) is lock:
+            _fetch_locks.pop(source_id)
+
+def _resize(original_path: str, width: int, fmt: str) -> bytes:
+    with Image.open(original_path) as image:
+        image.load()
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        out = BytesIO()
+        image.save(out, format=fmt.upper(), quality=IMAGE_QUALITY)
+        return out.getvalue()
+
+
+def snap_width(width: Optional[int]) -> Optional[int]:
+    """Smallest configured width >= the requested one (None or 0 = original)"""
+    if not width or not IMAGE_WIDTHS:
+        return None
+    return next((w for w in IMAGE_WIDTHS if w >= width), IMAGE_WIDTHS[-1])
+
+
+async def get_image(source_id: str, width: Optional[int], fmt: str) -> Tuple[str, str, str]:
+    """
+    Path, media type and ETag of the requested rendition, creating it on first use
+    Raises ImageNotFound for unregistered ids and ImageFetchError if the source fails
+    """
+    if not valid_image_id(source_id):
+        raise ImageNotFound(source_id)
+    source = _load_source(source_id)
+    if source is None:
+        raise ImageNotFound(source_id)
+    if not source.get("sha256"):
+        source = await _fetch_original(source_id, source)
+    content_hash = source["sha256"]
+    original_path = _blob_path(content_hash, "")
+
+    width = snap_width(width)
+    if width is None or not RESIZE_AVAILABLE:
+        return original_path, source["content_type"], f'"{content_hash[:32]}"'
+
+    fmt = fmt if fmt in FORMATS else "jpeg"
+    thumb_path = _blob_path(content_hash, f"_{width}.{fmt}")
+    if not os.path.exists(thumb_path):
+        try:
+            data = await asyncio.to_thread(_resize, original_path, width, fmt)
+        except Exception as e:
+            raise ImageFetchError(f"Could not resize image: {e}")
+        _write_atomic(thumb_path, data)
+    return thumb_path, FORMATS[fmt], f'"{content_hash[:32]}-{width}-{fmt}"'
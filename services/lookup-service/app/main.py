@@ -1,174 +1,221 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+import asyncio
 import httpx
-import sqlite3
-import json
 import os
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime
+from typing import Optional, List, Dict
+from .cache import (
+    init_cache_db, close_connection, get_from_cache, save_to_cache, get_many_from_cache,
+    save_many_to_cache, delete_from_cache, clear_cache, get_negative_cached, save_negative,
+    purge_negative, flush_hit_counts, get_refresh_candidates, uncached_barcodes, prune_cache,
+    cache_stats as get_cache_stats
+)
+from .categories import load_category_map
+from .images import ImageNotFound, ImageFetchError, get_image, register_urls, RESIZE_AVAILABLE, IMAGE_WIDTHS
+from .offline_db import get_offline, get_many_offline, offline_stats, close_connection as close_offline_connection
+from .providers import ProviderError, init_providers, active_providers, call_provider, provider_stats
 
 app = FastAPI(title="PantryPal Lookup Service", version="1.0.0")
 
-CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "/app/data/lookup_cache.db")
-CACHE_TTL_DAYS = int(os.getenv("CACHE_TTL_DAYS", "30"))
-
-def init_cache_db():
-    os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS lookup_cache (
-            barcode TEXT PRIMARY KEY,
-            product_data TEXT NOT NULL,
-            cached_at TIMESTAMP NOT NULL,
-            expires_at TIMESTAMP NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
+BATCH_MAX_SIZE = int(os.getenv("LOOKUP_BATCH_MAX_SIZE", "100"))
+BATCH_CONCURRENCY = int(os.getenv("LOOKUP_BATCH_CONCURRENCY", "5"))
+
+# How upstream providers are consulted on a cache miss:
+#   sequential - one after another in priority order
+#   parallel   - all at once, the highest-priority hit wins
+#   hedged     - start the next provider if the previous hasn't answered within LOOKUP_HEDGE_DELAY_MS
+RESOLUTION_STRATEGIES = ("sequential", "parallel", "hedged")
+RESOLUTION_STRATEGY = os.getenv("LOOKUP_STRATEGY", "sequential").lower()
+if RESOLUTION_STRATEGY not in RESOLUTION_STRATEGIES:
+    print(f"Unknown LOOKUP_STRATEGY '{RESOLUTION_STRATEGY}', using sequential")
+    RESOLUTION_STRATEGY = "sequential"
+HEDGE_DELAY_SECONDS = int(os.getenv("LOOKUP_HEDGE_DELAY_MS", "500")) / 1000
+
+# Background refresh of entries nearing expiry (0 disables), most hit first
+REFRESH_INTERVAL_SECONDS = int(os.getenv("LOOKUP_REFRESH_INTERVAL", "3600"))
+REFRESH_WINDOW_HOURS = int(os.getenv("LOOKUP_REFRESH_WINDOW_HOURS", "48"))
+REFRESH_BATCH_SIZE = int(os.getenv("LOOKUP_REFRESH_BATCH_SIZE", "50"))
+# Periodic prune of expired/excess entries and incremental vacuum (0 disables)
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("CACHE_MAINTENANCE_INTERVAL", "21600"))
+# Preload every barcode in the inventory when the service starts
+WARMUP_ON_STARTUP = os.getenv("LOOKUP_WARMUP_ON_STARTUP", "false").lower() == "true"
+INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://inventory-service:8001")
+
+# Browsers and the mobile app may keep thumbnails for this long; the URLs are content-addressed
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+class BatchLookupRequest(BaseModel):
+    barcodes: List[str]
+
+class RegisterImagesRequest(BaseModel):
+    urls: List[str]
 
 init_cache_db()
+init_providers()
+load_category_map()
 
-def get_from_cache(barcode: str) -> Optional[dict]:
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT product_data, expires_at FROM lookup_cache WHERE barcode = ? AND expires_at > ?", 
-                   (barcode, datetime.utcnow().isoformat()))
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        return json.loads(result[0])
-    return None
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "lookup-service", "timestamp": datetime.utcnow().isoformat()}
 
-def save_to_cache(barcode: str, product_data: dict):
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cached_at = datetime.utcnow()
-    expires_at = cached_at + timedelta(days=CACHE_TTL_DAYS)
-    cursor.execute("INSERT OR REPLACE INTO lookup_cache (barcode, product_data, cached_at, expires_at) VALUES (?, ?, ?, ?)",
-                   (barcode, json.dumps(product_data), cached_at.isoformat(), expires_at.isoformat()))
-    conn.commit()
-    conn.close()
-
-def extract_category(categories_str: str) -> str:
-    """Extract the main category from the categories string"""
-    if not categories_str:
-        return "Uncategorized"
-    
-    # Split by comma and get the first/main category
-    categories = categories_str.split(',')
-    if not categories:
-        return "Uncategorized"
-    
-    main_category = categories[0].strip()
-    
-    # Simplify common categories
-    category_map = {
-        'beverages': 'Beverages',
-        'drinks': 'Beverages',
-        'sodas': 'Beverages',
-        'water': 'Beverages',
-        'juices': 'Beverages',
-        'snacks': 'Snacks',
-        'chips': 'Snacks',
-        'cookies': 'Snacks',
-        'candy': 'Snacks',
-        'chocolate': 'Snacks',
-        'dairy': 'Dairy',
-        'milk': 'Dairy',
-        'cheese': 'Dairy',
-        'yogurt': 'Dairy',
-        'canned': 'Canned Goods',
-        'preserved': 'Canned Goods',
-        'cereals': 'Breakfast',
-        'breakfast': 'Breakfast',
-        'bread': 'Bakery',
-        'pastries': 'Bakery',
-        'frozen': 'Frozen',
-        'ice cream': 'Frozen',
-        'meat': 'Meat & Seafood',
-        'seafood': 'Meat & Seafood',
-        'fish': 'Meat & Seafood',
-        'produce': 'Fresh Produce',
-        'fruits': 'Fresh Produce',
-        'vegetables': 'Fresh Produce',
-        'condiments': 'Condiments',
-        'sauces': 'Condiments',
-        'cleaning': 'Cleaning',
-        'detergent': 'Cleaning',
-        'soap': 'Cleaning',
-        'household': 'Household',
-        'paper': 'Household',
-        'tissue': 'Household',
-        'personal care': 'Personal Care',
-        'beauty': 'Personal Care',
-        'hygiene': 'Personal Care',
-        'health': 'Health',
-        'medicine': 'Health',
-        'vitamins': 'Health',
+def unknown_product(barcode: str) -> dict:
+    return {
+        "barcode": barcode,
+        "name": f"Unknown Product ({barcode})",
+        "brand": None,
+        "image_url": None,
+        "category": "Uncategorized",
+        "source": None,
+        "found": False,
+        "from_cache": False
     }
 
-    main_lower = main_category.lower()
-    for keyword, mapped_category in category_map.items():
-        if keyword in main_lower:
-            return mapped_category
+resolution_stats = {"hedges_fired": 0, "losers_cancelled": 0}
 
-    return main_category.title() if main_category else "Uncategorized"
+def _cancel_losers(tasks: List[asyncio.Task]):
+    for task in tasks:
+        if task.done():
+            # Retrieve errors nobody waited for so asyncio doesn't log them
+            if not task.cancelled():
+                task.exception()
+        else:
+            task.cancel()
+            resolution_stats["losers_cancelled"] += 1
 
-async def lookup_open_food_facts(barcode: str) -> Optional[dict]:
-    url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+async def resolve_sequential(barcode: str) -> Optional[dict]:
+    error = None
+    for provider in active_providers():
+        try:
+            product_data = await call_provider(provider, barcode)
+        except ProviderError as e:
+            print(e)
+            error = e
+            continue
+        if product_data:
+            return product_data
+    if error:
+        raise error
+    return None
+
+async def resolve_parallel(barcode: str) -> Optional[dict]:
+    """Start every provider at once and take results in priority order"""
+    tasks = [asyncio.ensure_future(call_provider(provider, barcode))
+             for provider in active_providers()]
+    error = None
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=10.0)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("status") == 1 and "product" in data:
-                    product = data["product"]
-
-                    categories = product.get("categories", "")
-                    category = extract_category(categories)
-
-                    return {
-                        "barcode": barcode,
-                        "name": product.get("product_name", "Unknown Product"),
-                        "brand": product.get("brands", "").split(",")[0].strip() if product.get("brands") else None,
-                        "image_url": product.get("image_url"),
-                        "category": category,
-                        "source": "Open Food Facts",
-                        "found": True
-                    }
-    except Exception as e:
-        print(f"Open Food Facts lookup error: {e}")
+        for task in tasks:
+            try:
+                product_data = await task
+            except ProviderError as e:
+                print(e)
+                error = e
+                continue
+            if product_data:
+                return product_data
+    finally:
+        _cancel_losers(tasks)
+    if error:
+        raise error
     return None
 
-async def lookup_upcitemdb(barcode: str) -> Optional[dict]:
-    url = f"https://api.upcitemdb.com/prod/trial/lookup?upc={barcode}"
+async def resolve_hedged(barcode: str) -> Optional[dict]:
+    """
+    Start providers in priority order, each one HEDGE_DELAY_SECONDS after the
+    previous (or immediately once it misses); the first hit wins
+    """
+    loop = asyncio.get_running_loop()
+    tasks: List[asyncio.Task] = []
+    pending = set()
+    error = None
+
+    def take_hit(done) -> Optional[dict]:
+        nonlocal error
+        for task in [t for t in tasks if t in done]:
+            try:
+                product_data = task.result()
+            except ProviderError as e:
+                print(e)
+                error = e
+                continue
+            if product_data:
+                return product_data
+        return None
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, timeout=10.0)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("code") == "OK" and data.get("items") and len(data["items"]) > 0:
-                    item = data["items"][0]
-
-                    category_raw = item.get("category", "")
-                    category = extract_category(category_raw)
-
-                    return {
-                        "barcode": barcode,
-                        "name": item.get("title", "Unknown Product"),
-                        "brand": item.get("brand"),
-                        "image_url": item.get("images", [None])[0] if item.get("images") else None,
-                        "category": category,
-                        "source": "UPCitemDB",
-                        "found": True
-                    }
-    except Exception as e:
-        print(f"UPCitemDB lookup error: {e}")
+        provider_list = active_providers()
+        for index, provider in enumerate(provider_list):
+            if index > 0:
+                resolution_stats["hedges_fired"] += 1
+            task = asyncio.ensure_future(call_provider(provider, barcode))
+            tasks.append(task)
+            pending.add(task)
+            if index == len(provider_list) - 1:
+                break
+
+            deadline = loop.time() + HEDGE_DELAY_SECONDS
+            while pending and loop.time() < deadline:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED
+                )
+                product_data = take_hit(done)
+                if product_data:
+                    return product_data
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            product_data = take_hit(done)
+            if product_data:
+                return product_data
+    finally:
+        _cancel_losers(tasks)
+
+    if error:
+        raise error
     return None
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "service": "lookup-service", "timestamp": datetime.utcnow().isoformat()}
+async def resolve_from_providers(barcode: str) -> Optional[dict]:
+    """
+    Query the upstream product databases using LOOKUP_STRATEGY
+    Returns None only when every provider answered "not found"; if none found
+    it and at least one failed, the ProviderError is raised instead
+    """
+    if RESOLUTION_STRATEGY == "parallel":
+        return await resolve_parallel(barcode)
+    if RESOLUTION_STRATEGY == "hedged":
+        return await resolve_hedged(barcode)
+    return await resolve_sequential(barcode)
+
+# Upstream resolutions currently running, keyed by barcode (single-flight)
+_in_flight: Dict[str, asyncio.Task] = {}
+single_flight_stats = {"upstream_resolutions": 0, "coalesced": 0}
+
+def _finish_in_flight(barcode: str, task: asyncio.Task):
+    _in_flight.pop(barcode, None)
+    # Mark a ProviderError as retrieved even if every waiter went away
+    if not task.cancelled():
+        task.exception()
+
+async def resolve_coalesced(barcode: str):
+    """
+    Resolve a barcode upstream, sharing one resolution between concurrent callers
+    Returns (product_data, is_leader); only the leader should write the cache
+    Raises ProviderError when the result is inconclusive
+    """
+    task = _in_flight.get(barcode)
+    is_leader = task is None
+    if is_leader:
+        single_flight_stats["upstream_resolutions"] += 1
+        task = asyncio.ensure_future(resolve_from_providers(barcode))
+        _in_flight[barcode] = task
+        task.add_done_callback(lambda t: _finish_in_flight(barcode, t))
+    else:
+        single_flight_stats["coalesced"] += 1
+
+    # Shield so a disconnecting caller doesn't cancel the lookup for everyone else
+    product_data = await asyncio.shield(task)
+    return (dict(product_data) if product_data else None), is_leader
 
 @app.get("/lookup/{barcode}")
 async def lookup_barcode(barcode: str):
@@ -177,48 +224,268 @@ async def lookup_barcode(barcode: str):
         cached_data["from_cache"] = True
         return cached_data
 
-    product_data = await lookup_open_food_facts(barcode)
-    if product_data:
-        save_to_cache(barcode, product_data)
-        product_data["from_cache"] = False
-        return product_data
+    offline_data = get_offline(barcode)
+    if offline_data:
+        offline_data["from_cache"] = False
+        return offline_data
+
+    if get_negative_cached([barcode]):
+        return {**unknown_product(barcode), "from_cache": True}
+
+    try:
+        product_data, is_leader = await resolve_coalesced(barcode)
+    except ProviderError:
+        # Don't remember a miss we aren't sure about
+        return unknown_product(barcode)
 
-    product_data = await lookup_upcitemdb(barcode)
     if product_data:
-        save_to_cache(barcode, product_data)
+        if is_leader:
+            save_to_cache(barcode, product_data)
         product_data["from_cache"] = False
         return product_data
 
+    if is_leader:
+        save_negative([barcode])
+    return unknown_product(barcode)
+
+async def resolve_and_cache(barcodes: List[str]) -> Dict[str, dict]:
+    """
+    Resolve barcodes upstream, at most LOOKUP_BATCH_CONCURRENCY at a time
+    Hits and conclusive misses are each cached in one transaction; returns the hits
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def resolve(barcode: str):
+        async with semaphore:
+            try:
+                return (barcode, *await resolve_coalesced(barcode), True)
+            except ProviderError:
+                return barcode, None, False, False
+
+    resolved = {}
+    to_cache = {}
+    not_found = []
+    for barcode, product_data, is_leader, conclusive in await asyncio.gather(*(resolve(b) for b in barcodes)):
+        if product_data:
+            resolved[barcode] = product_data
+            if is_leader:
+                to_cache[barcode] = product_data
+        elif is_leader and conclusive:
+            not_found.append(barcode)
+    save_many_to_cache(to_cache)
+    save_negative(not_found)
+    return resolved
+
+@app.post("/lookup/batch")
+async def lookup_batch(request: BatchLookupRequest):
+    """
+    Look up many barcodes at once
+    Cache hits come from one query; misses are resolved concurrently
+    (at most LOOKUP_BATCH_CONCURRENCY at a time) and cached in one transaction
+    The offline product database and the negative cache are checked before going upstream
+    """
+    barcodes = list(dict.fromkeys(b.strip() for b in request.barcodes if b.strip()))
+    if len(barcodes) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_SIZE} barcodes per batch")
+
+    results = {}
+    for barcode, cached_data in get_many_from_cache(barcodes).items():
+        cached_data["from_cache"] = True
+        results[barcode] = cached_data
+    for barcode, offline_data in get_many_offline([b for b in barcodes if b not in results]).items():
+        offline_data["from_cache"] = False
+        results[barcode] = offline_data
+    for barcode in get_negative_cached([b for b in barcodes if b not in results]):
+        results[barcode] = {**unknown_product(barcode), "from_cache": True}
+
+    misses = [b for b in barcodes if b not in results]
+    resolved = await resolve_and_cache(misses)
+
+    for barcode in misses:
+        if barcode in resolved:
+            resolved[barcode]["from_cache"] = False
+            results[barcode] = resolved[barcode]
+        else:
+            results[barcode] = unknown_product(barcode)
+
     return {
-        "barcode": barcode,
-        "name": f"Unknown Product ({barcode})",
-        "brand": None,
-        "image_url": None,
-        "category": "Uncategorized",
-        "source": None,
-        "found": False,
-        "from_cache": False
+        "results": [results[b] for b in barcodes],
+        "total": len(barcodes),
+        "found": sum(1 for b in barcodes if results[b].get("found")),
+        "from_cache": sum(1 for b in barcodes if results[b].get("from_cache"))
+    }
+
+# ----------------------------------------------------------------------------
+# Warm-up and background refresh
+# ----------------------------------------------------------------------------
+
+refresh_stats = {"runs": 0, "refreshed": 0, "last_run": None, "last_warmup": None}
+_refresh_task: Optional[asyncio.Task] = None
+_maintenance_task: Optional[asyncio.Task] = None
+_warmup_task: Optional[asyncio.Task] = None
+
+async def refresh_expiring_entries() -> int:
+    """Re-fetch the most hit entries that expire within LOOKUP_REFRESH_WINDOW_HOURS"""
+    flush_hit_counts()
+    barcodes = get_refresh_candidates(REFRESH_WINDOW_HOURS * 3600, REFRESH_BATCH_SIZE)
+    refreshed = await resolve_and_cache(barcodes)
+    refresh_stats["runs"] += 1
+    refresh_stats["refreshed"] += len(refreshed)
+    refresh_stats["last_run"] = {
+        "at": datetime.utcnow().isoformat(),
+        "candidates": len(barcodes),
+        "refreshed": len(refreshed)
+    }
+    return len(refreshed)
+
+async def refresh_loop():
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+        try:
+            await refresh_expiring_entries()
+        except Exception as e:
+            print(f"Cache refresh error: {e}")
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            # Batched deletes and vacuum are blocking SQLite work, keep them off the event loop
+            result = await asyncio.to_thread(prune_cache)
+            print(f"Cache maintenance finished: {result}")
+        except Exception as e:
+            print(f"Cache maintenance error: {e}")
+
+async def fetch_inventory_barcodes() -> List[str]:
+    """Every distinct barcode in the inventory, paging through GET /items"""
+    barcodes = []
+    cursor = None
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        while True:
+            params = {"fields": "barcode", "limit": 1000}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get(f"{INVENTORY_SERVICE_URL}/items", params=params)
+            response.raise_for_status()
+            barcodes.extend(item["barcode"] for item in response.json() if item.get("barcode"))
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+    return list(dict.fromkeys(barcodes))
+
+async def warm_up_cache() -> Dict:
+    """Resolve inventory barcodes that are in neither cache nor the offline database"""
+    barcodes = await fetch_inventory_barcodes()
+    missing = uncached_barcodes(barcodes)
+    offline = get_many_offline(missing)
+    to_resolve = [b for b in missing if b not in offline]
+    resolved = await resolve_and_cache(to_resolve)
+    summary = {
+        "at": datetime.utcnow().isoformat(),
+        "inventory_barcodes": len(barcodes),
+        "already_cached": len(barcodes) - len(missing),
+        "offline": len(offline),
+        "resolved": len(resolved),
+        "unresolved": len(to_resolve) - len(resolved)
     }
+    refresh_stats["last_warmup"] = summary
+    return summary
+
+async def run_warmup():
+    try:
+        summary = await warm_up_cache()
+        print(f"Cache warm-up finished: {summary}")
+    except Exception as e:
+        print(f"Cache warm-up error: {e}")
+
+@app.post("/cache/warm", status_code=202)
+async def start_cache_warmup():
+    """Preload every inventory barcode into the cache in the background"""
+    global _warmup_task
+    if _warmup_task and not _warmup_task.done():
+        return {"message": "Cache warm-up already running"}
+    _warmup_task = asyncio.create_task(run_warmup())
+    return {"message": "Cache warm-up started"}
+
+@app.post("/cache/refresh")
+async def refresh_cache_now():
+    """Run one background-refresh pass immediately"""
+    refreshed = await refresh_expiring_entries()
+    return {"message": f"Refreshed {refreshed} cache entries", "last_run": refresh_stats["last_run"]}
+
+@app.post("/cache/prune")
+async def prune_cache_now():
+    """Delete expired entries, enforce CACHE_MAX_ENTRIES and vacuum freed pages"""
+    return await asyncio.to_thread(prune_cache)
+
+@app.on_event("startup")
+async def startup_event():
+    global _refresh_task, _maintenance_task, _warmup_task
+    if REFRESH_INTERVAL_SECONDS > 0:
+        _refresh_task = asyncio.create_task(refresh_loop())
+    if MAINTENANCE_INTERVAL_SECONDS > 0:
+        _maintenance_task = asyncio.create_task(maintenance_loop())
+    if WARMUP_ON_STARTUP:
+        _warmup_task = asyncio.create_task(run_warmup())
+
+# ----------------------------------------------------------------------------
+# Image proxy
+# ----------------------------------------------------------------------------
+
+@app.post("/images/register")
+async def register_images(request: RegisterImagesRequest):
+    """Allow remote product images to be served through /images/{image_id}"""
+    return {"images": register_urls(request.urls), "resize_available": RESIZE_AVAILABLE, "widths": IMAGE_WIDTHS}
+
+@app.get("/images/{image_id}")
+async def get_product_image(image_id: str, request: Request, w: Optional[int] = None, format: Optional[str] = None):
+    """
+    A registered product image, resized to width w (snapped to IMAGE_WIDTHS)
+    Served as WebP when requested or accepted by the client, JPEG otherwise
+    """
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    try:
+        path, media_type, etag = await get_image(image_id, w, format.lower())
+    except ImageNotFound:
+        raise HTTPException(status_code=404, detail="Image not registered")
+    except ImageFetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable", "Vary": "Accept"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
 
 @app.get("/cache/stats")
 async def cache_stats():
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM lookup_cache")
-    total = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM lookup_cache WHERE expires_at > ?", (datetime.utcnow().isoformat(),))
-    valid = cursor.fetchone()[0]
-    conn.close()
-    return {"total_cached": total, "valid_cached": valid, "expired": total - valid, "ttl_days": CACHE_TTL_DAYS}
+    return {
+        **get_cache_stats(),
+        "single_flight": {**single_flight_stats, "in_flight": len(_in_flight)},
+        "resolution": {"strategy": RESOLUTION_STRATEGY, **resolution_stats},
+        "offline": offline_stats(),
+        "refresh": {
+            "interval_seconds": REFRESH_INTERVAL_SECONDS,
+            "window_hours": REFRESH_WINDOW_HOURS,
+            "warmup_running": bool(_warmup_task and not _warmup_task.done()),
+            **refresh_stats
+        }
+    }
+
+@app.get("/providers/stats")
+async def get_provider_stats():
+    """Circuit breaker state, latency histogram and outcome counts per provider"""
+    return {"order": [p.name for p in active_providers()], "providers": provider_stats()}
+
+@app.delete("/cache/negative")
+async def clear_negative_cache():
+    """Forget every remembered not-found barcode so they are retried upstream"""
+    deleted = purge_negative()
+    return {"message": f"Negative cache cleared, {deleted} barcodes removed"}
 
 @app.delete("/cache/{barcode}")
 async def clear_cache_item(barcode: str):
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM lookup_cache WHERE barcode = ?", (barcode,))
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
+    deleted = delete_from_cache(barcode)
     if deleted > 0:
         return {"message": f"Cache cleared for barcode {barcode}"}
     else:
@@ -226,14 +493,18 @@ async def clear_cache_item(barcode: str):
 
 @app.delete("/cache")
 async def clear_all_cache():
-    conn = sqlite3.connect(CACHE_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM lookup_cache")
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
+    deleted = clear_cache()
     return {"message": f"Cache cleared, {deleted} items removed"}
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (_refresh_task, _maintenance_task, _warmup_task):
+        if task and not task.done():
+            task.cancel()
+    flush_hit_counts()
+    close_connection()
+    close_offline_connection()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
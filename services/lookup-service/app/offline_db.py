@@ -0,0 +1,244 @@
+"""
+Offline product database built from an Open Food Facts dump
+
+The importer streams a CSV/TSV or JSONL export (optionally gzipped) into a
+compact products table, committing every IMPORT_BATCH_SIZE rows together
+with a checkpoint, so memory stays bounded and an interrupted import
+resumes where it stopped. Lookups read the table before any HTTP provider.
+
+    python -m app.offline_db import /data/en.openfoodfacts.org.products.csv.gz
+    python -m app.offline_db import /data/openfoodfacts-products.jsonl.gz --restart
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from .categories import extract_category, load_category_map
+
+OFFLINE_DB_PATH = os.getenv("OFFLINE_DB_PATH", "/app/data/offline_products.db")
+IMPORT_BATCH_SIZE = int(os.getenv("OFFLINE_IMPORT_BATCH_SIZE", "5000"))
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def connect(path: str = OFFLINE_DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            barcode TEXT PRIMARY KEY,
+            name TEXT,
+            brand TEXT,
+            image_url TEXT,
+            category TEXT
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_state (
+            source TEXT PRIMARY KEY,
+            records_done INTEGER NOT NULL,
+            imported INTEGER NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def get_connection() -> Optional[sqlite3.Connection]:
+    """Shared connection for lookups, or None until a database has been imported"""
+    global _conn
+    if _conn is None and os.path.exists(OFFLINE_DB_PATH):
+        _conn = connect()
+    return _conn
+
+
+def close_connection():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def get_many_offline(barcodes: List[str]) -> Dict[str, dict]:
+    """Products for the barcodes present in the offline database"""
+    if not barcodes:
+        return {}
+    with _lock:
+        conn = get_connection()
+        if conn is None:
+            return {}
+        placeholders = ",".join("?" for _ in barcodes)
+        rows = conn.execute(
+            f"SELECT barcode, name, brand, image_url, category FROM products WHERE barcode IN ({placeholders})",
+            barcodes
+        ).fetchall()
+    return {
+        barcode: {
+            "barcode": barcode,
+            "name": name or "Unknown Product",
+            "brand": brand,
+            "image_url": image_url,
+            "category": category,
+            "source": "Open Food Facts (offline)",
+            "found": True
+        }
+        for barcode, name, brand, image_url, category in rows
+    }
+
+
+def get_offline(barcode: str) -> Optional[dict]:
+    return get_many_offline([barcode]).get(barcode)
+
+
+def offline_stats() -> Dict:
+    with _lock:
+        conn = get_connection()
+        if conn is None:
+            return {"enabled": False}
+        products = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        imports = [
+            {"source": source, "records_done": records_done, "imported": imported,
+             "completed": bool(completed), "updated_at": updated_at}
+            for source, records_done, imported, completed, updated_at in conn.execute(
+                "SELECT source, records_done, imported, completed, updated_at FROM import_state"
+            )
+        ]
+    return {"enabled": True, "products": products, "imports": imports}
+
+
+# ----------------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------------
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def _detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    return "jsonl" if name.endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+
+def iter_records(path: str, file_format: str) -> Iterator[dict]:
+    """Stream raw product records from the dump, one at a time"""
+    with _open_text(path) as f:
+        if file_format == "jsonl":
+            for line in f:
+                line = line.strip()
+                if not line:
+                    yield {}
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {}
+        else:
+            # The official "CSV" export is tab separated and has very long fields
+            csv.field_size_limit(sys.maxsize)
+            header = f.readline()
+            delimiter = "\t" if "\t" in header else ","
+            # The TSV export doesn't quote fields, so stray quotes must stay literal
+            quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+            fieldnames = next(csv.reader(io.StringIO(header), delimiter=delimiter, quoting=quoting))
+            yield from csv.DictReader(f, fieldnames=fieldnames, delimiter=delimiter, quoting=quoting)
+
+
+def to_row(record: dict) -> Optional[tuple]:
+    """Compact (barcode, name, brand, image_url, category) row, or None to skip"""
+    barcode = str(record.get("code") or "").strip()
+    if not barcode:
+        return None
+    name = (record.get("product_name") or "").strip()
+    brands = record.get("brands") or ""
+    if isinstance(brands, list):
+        brands = ",".join(brands)
+    brand = brands.split(",")[0].strip() or None
+    image_url = record.get("image_url") or record.get("image_front_url") or None
+    categories = record.get("categories") or ""
+    if isinstance(categories, list):
+        categories = ",".join(categories)
+    if not name and not brand:
+        return None
+    return barcode, name or None, brand, image_url, extract_category(categories)
+
+
+def import_dump(path: str, file_format: Optional[str] = None, restart: bool = False,
+                db_path: str = OFFLINE_DB_PATH, batch_size: int = IMPORT_BATCH_SIZE) -> Dict:
+    """
+    Import an Open Food Facts dump, resuming from the last checkpoint for this file
+    Returns {"records": ..., "imported": ..., "resumed_from": ...}
+    """
+    file_format = file_format or _detect_format(path)
+    source = os.path.abspath(path)
+    conn = connect(db_path)
+    try:
+        state = conn.execute("SELECT records_done, imported, completed FROM import_state WHERE source = ?",
+                             (source,)).fetchone()
+        resume_from, imported = (state[0], state[1]) if state and not restart else (0, 0)
+        if state and state[2] and not restart:
+            return {"records": state[0], "imported": state[1], "resumed_from": state[0], "skipped": True}
+
+        def checkpoint(records_done: int, completed: bool):
+            conn.execute(
+                "INSERT OR REPLACE INTO import_state (source, records_done, imported, completed, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (source, records_done, imported, int(completed), datetime.utcnow().isoformat())
+            )
+            conn.commit()
+
+        batch = []
+        records = 0
+        for record in iter_records(path, file_format):
+            records += 1
+            if records <= resume_from:
+                continue
+            row = to_row(record)
+            if row:
+                batch.append(row)
+            if records % batch_size == 0:
+                conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)", batch)
+                imported += len(batch)
+                batch.clear()
+                # Rows and checkpoint commit together, so a crash never skips or repeats a batch
+                checkpoint(records, completed=False)
+                print(f"Imported {imported} products ({records} records read)")
+
+        conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)", batch)
+        imported += len(batch)
+        checkpoint(records, completed=True)
+        return {"records": records, "imported": imported, "resumed_from": resume_from}
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PantryPal offline product database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import an Open Food Facts CSV or JSONL dump")
+    import_parser.add_argument("path", help="Dump file (.csv, .jsonl, optionally .gz)")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="Override format detection")
+    import_parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    import_parser.add_argument("--db", default=OFFLINE_DB_PATH, help="Offline database path")
+    args = parser.parse_args()
+
+    load_category_map()
+    result = import_dump(args.path, args.format, restart=args.restart, db_path=args.db)
+    if result.get("skipped"):
+        print(f"{args.path} was already imported ({result['imported']} products); use --restart to re-import")
+    else:
+        print(f"Imported {result['imported']} products from {result['records']} records")
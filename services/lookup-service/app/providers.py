@@ -0,0 +1,356 @@
+"""
+Upstream product providers
+
+Every provider is registered with its own circuit breaker, token-bucket
+rate limit and latency/outcome histogram. call_provider() wraps a lookup
+with all of them plus jittered retries, so a provider that is down or out
+of quota fails fast instead of holding every cache miss to its timeout.
+"""
+import abc
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+import httpx
+from .categories import extract_category
+
+# Comma-separated priority order; "local" reads LOCAL_PRODUCTS_FILE (handy for tests and offline setups)
+PROVIDER_ORDER = [p.strip() for p in os.getenv("PROVIDER_ORDER", "open_food_facts,upcitemdb").split(",") if p.strip()]
+
+OFF_TIMEOUT = float(os.getenv("OFF_TIMEOUT", "10"))
+OFF_RATE_PER_MINUTE = float(os.getenv("OFF_RATE_PER_MINUTE", "100"))
+UPCITEMDB_TIMEOUT = float(os.getenv("UPCITEMDB_TIMEOUT", "10"))
+# The UPCitemDB trial tier allows bursts of 6 requests per minute
+UPCITEMDB_RATE_PER_MINUTE = float(os.getenv("UPCITEMDB_RATE_PER_MINUTE", "6"))
+LOCAL_PRODUCTS_FILE = os.getenv("LOCAL_PRODUCTS_FILE", "/app/data/local_products.json")
+LOCAL_PROVIDER_DELAY_MS = int(os.getenv("LOCAL_PROVIDER_DELAY_MS", "0"))
+
+# Circuit breaker: open after this many consecutive failures, probe again after the reset time
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "5"))
+PROVIDER_RESET_SECONDS = float(os.getenv("PROVIDER_RESET_SECONDS", "30"))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", "1"))
+PROVIDER_RETRY_BASE_MS = int(os.getenv("PROVIDER_RETRY_BASE_MS", "200"))
+
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class ProviderError(Exception):
+    """A provider couldn't answer (network error, rate limit, server error)"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# ----------------------------------------------------------------------------
+# Resilience primitives
+# ----------------------------------------------------------------------------
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half_open probe after reset_seconds"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            # Let a single probe through
+            self.state = "half_open"
+            return True
+        if self.state == "half_open":
+            return False
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = burst if burst is not None else max(rate_per_minute, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.outcomes = {"found": 0, "not_found": 0, "error": 0, "timeout": 0,
+                         "circuit_open": 0, "rate_limited": 0, "retries": 0}
+
+    def observe(self, seconds: float, outcome: str):
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+        self.buckets[index] += 1
+        self.outcomes[outcome] += 1
+
+    def stats(self) -> Dict:
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["gt_10000ms"]
+        return {"latency": dict(zip(labels, self.buckets)), "outcomes": dict(self.outcomes)}
+
+
+# ----------------------------------------------------------------------------
+# Providers
+# ----------------------------------------------------------------------------
+
+class Provider(abc.ABC):
+    """Base class: fetch() returns the product, None for "not found", or raises ProviderError"""
+    name = "provider"
+    timeout = 10.0
+    rate_per_minute = 0.0
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(PROVIDER_FAILURE_THRESHOLD, PROVIDER_RESET_SECONDS)
+        self.bucket = TokenBucket(self.rate_per_minute)
+        self.histogram = LatencyHistogram()
+
+    @abc.abstractmethod
+    async def fetch(self, barcode: str, timeout: float) -> Optional[dict]:
+        ...
+
+
+class OpenFoodFactsProvider(Provider):
+    name = "open_food_facts"
+    timeout = OFF_TIMEOUT
+    rate_per_minute = OFF_RATE_PER_MINUTE
+
+    async def fetch(self, barcode: str, timeout: float) -> Optional[dict]:
+        url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(url, timeout=timeout)
+            if response.status_code == 404:
+                return None
+            if response.status_code != 200:
+                raise ProviderError(f"Open Food Facts returned {response.status_code}",
+                                    retryable=response.status_code >= 500)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise ProviderError(f"Open Food Facts lookup error: {e}")
+
+        if data.get("status") == 1 and "product" in data:
+            product = data["product"]
+
+            categories = product.get("categories", "")
+            category = extract_category(categories)
+
+            return {
+                "barcode": barcode,
+                "name": product.get("product_name", "Unknown Product"),
+                "brand": product.get("brands", "").split(",")[0].strip() if product.get("brands") else None,
+                "image_url": product.get("image_url"),
+                "category": category,
+                "source": "Open Food Facts",
+                "found": True
+            }
+        return None
+
+
+class UPCitemDBProvider(Provider):
+    name = "upcitemdb"
+    timeout = UPCITEMDB_TIMEOUT
+    rate_per_minute = UPCITEMDB_RATE_PER_MINUTE
+
+    async def fetch(self, barcode: str, timeout: float) -> Optional[dict]:
+        url = f"https://api.upcitemdb.com/prod/trial/lookup?upc={barcode}"
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(url, timeout=timeout)
+            # UPCitemDB answers 400 for codes that aren't valid UPC/EAN numbers
+            if response.status_code in (400, 404):
+                return None
+            if response.status_code != 200:
+                raise ProviderError(f"UPCitemDB returned {response.status_code}",
+                                    retryable=response.status_code >= 500)
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise ProviderError(f"UPCitemDB lookup error: {e}")
+
+        if data.get("code") == "OK" and data.get("items") and len(data["items"]) > 0:
+            item = data["items"][0]
+
+            category_raw = item.get("category", "")
+            category = extract_category(category_raw)
+
+            return {
+                "barcode": barcode,
+                "name": item.get("title", "Unknown Product"),
+                "brand": item.get("brand"),
+                "image_url": item.get("images", [None])[0] if item.get("images") else None,
+                "category": category,
+                "source": "UPCitemDB",
+                "found": True
+            }
+        return None
+
+
+class LocalProvider(Provider):
+    """
+    Products from a JSON file of {barcode: {name, brand, category, image_url}}
+    Stand-in for the real providers in tests and offline setups
+    """
+    name = "local"
+    timeout = 1.0
+
+    def __init__(self, path: str = LOCAL_PRODUCTS_FILE, delay_ms: int = LOCAL_PROVIDER_DELAY_MS):
+        super().__init__()
+        self.path = path
+        self.delay_ms = delay_ms
+        self._products: Optional[Dict[str, dict]] = None
+
+    def products(self) -> Dict[str, dict]:
+        if self._products is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._products = json.load(f)
+            except FileNotFoundError:
+                self._products = {}
+        return self._products
+
+    async def fetch(self, barcode: str, timeout: float) -> Optional[dict]:
+        if self.delay_ms:
+            await asyncio.sleep(self.delay_ms / 1000)
+        item = self.products().get(barcode)
+        if not item:
+            return None
+        return {
+            "barcode": barcode,
+            "name": item.get("name", "Unknown Product"),
+            "brand": item.get("brand"),
+            "image_url": item.get("image_url"),
+            "category": item.get("category") or "Uncategorized",
+            "source": "Local",
+            "found": True
+        }
+
+
+# ----------------------------------------------------------------------------
+# Registry
+# ----------------------------------------------------------------------------
+
+_registry: Dict[str, Provider] = {}
+_active: List[Provider] = []
+
+
+def register_provider(provider: Provider):
+    _registry[provider.name] = provider
+
+
+def init_providers(order: Optional[List[str]] = None):
+    """Register the built-in providers and activate them in PROVIDER_ORDER"""
+    for provider in (OpenFoodFactsProvider(), UPCitemDBProvider(), LocalProvider()):
+        _registry.setdefault(provider.name, provider)
+    set_provider_order(order or PROVIDER_ORDER)
+
+
+def set_provider_order(order: List[str]):
+    unknown = [name for name in order if name not in _registry]
+    if unknown:
+        print(f"Ignoring unknown providers in PROVIDER_ORDER: {', '.join(unknown)}")
+    _active[:] = [_registry[name] for name in order if name in _registry]
+
+
+def active_providers() -> List[Provider]:
+    """Providers to consult, in priority order"""
+    return list(_active)
+
+
+async def call_provider(provider: Provider, barcode: str) -> Optional[dict]:
+    """
+    Look a barcode up at one provider, within provider.timeout overall
+    Retries retryable failures with jittered exponential backoff; an open
+    breaker or an empty token bucket fails immediately
+    """
+    if not provider.breaker.allow():
+        provider.histogram.outcomes["circuit_open"] += 1
+        raise ProviderError(f"{provider.name} circuit open", retryable=False)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + provider.timeout
+    attempt = 0
+    while True:
+        if not provider.bucket.try_acquire():
+            provider.histogram.outcomes["rate_limited"] += 1
+            if provider.breaker.state == "half_open":
+                # Give the probe back so the breaker isn't stuck half open
+                provider.breaker.state = "open"
+            raise ProviderError(f"{provider.name} rate limit reached", retryable=False)
+
+        remaining = deadline - loop.time()
+        try:
+            product_data = await asyncio.wait_for(provider.fetch(barcode, remaining), remaining)
+        except asyncio.TimeoutError:
+            provider.breaker.record_failure()
+            provider.histogram.observe(loop.time() - started, "timeout")
+            raise ProviderError(f"{provider.name} timed out after {provider.timeout}s", retryable=False)
+        except ProviderError as e:
+            backoff = PROVIDER_RETRY_BASE_MS / 1000 * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if e.retryable and attempt < PROVIDER_RETRIES and loop.time() + backoff < deadline:
+                attempt += 1
+                provider.histogram.outcomes["retries"] += 1
+                await asyncio.sleep(backoff)
+                continue
+            provider.breaker.record_failure()
+            provider.histogram.observe(loop.time() - started, "error")
+            raise
+        except asyncio.CancelledError:
+            # Cancelled as a losing request; neither success nor failure
+            if provider.breaker.state == "half_open":
+                provider.breaker.state = "open"
+            raise
+        except Exception as e:
+            # Unexpected response shapes (e.g. "product": null) count as failures like any other error
+            provider.breaker.record_failure()
+            provider.histogram.observe(loop.time() - started, "error")
+            raise ProviderError(f"{provider.name} returned an unusable response: {e!r}", retryable=False)
+
+        provider.breaker.record_success()
+        provider.histogram.observe(loop.time() - started, "found" if product_data else "not_found")
+        return product_data
+
+
+def provider_stats() -> Dict:
+    return {
+        name: {
+            "active": provider in _active,
+            "timeout_seconds": provider.timeout,
+            "rate_per_minute": provider.rate_per_minute,
+            "circuit": provider.breaker.stats(),
+            **provider.histogram.stats()
+        }
+        for name, provider in _registry.items()
+    }